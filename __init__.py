@@ -1,20 +1,39 @@
+import os
 from . import raffle
+from . import raffle_batch  # Import the batch raffle module
+from . import raffle_similar  # Import the similarity search module
 from . import preview_history  # Import the renamed module
 from . import tag_category_strength  # Import the new module
 from . import curved_rescale_cfg  # Import the curved rescale cfg module
 from .raffle import Raffle
+from .raffle_batch import RaffleBatch # Import the batch raffle class
+from .raffle_similar import RaffleSimilar # Import the similarity search class
 from .preview_history import PreviewHistory # Import the renamed class
 from .tag_category_strength import TagCategoryStrength # Import the new class
 from .curved_rescale_cfg import CurvedRescaleCFG # Import the curved rescale cfg class
+from . import index_warmup  # Import the index warm-up module
+from . import pool_size_api  # Import the pool size HTTP route module
+
+# Load Raffle's taglist and category indexes in the background so the first queue doesn't pay for it.
+# Set the environment variable RAFFLE_WARMUP=0 to disable.
+if os.environ.get("RAFFLE_WARMUP", "1") != "0":
+    index_warmup.start_warmup()
+
+# Let the frontend ask for the pool size of a set of filters without queueing a prompt
+pool_size_api.register_routes()
 
 NODE_CLASS_MAPPINGS = {
     "Raffle": Raffle,
+    "RaffleBatch": RaffleBatch,  # Add the batch raffle mapping
+    "RaffleSimilar": RaffleSimilar,  # Add the similarity search mapping
     "PreviewHistory": PreviewHistory,  # Add the renamed mapping
     "TagCategoryStrength": TagCategoryStrength,  # Add the new mapping
     "CurvedRescaleCFG": CurvedRescaleCFG  # Add the curved rescale cfg mapping
 }
 NODE_DISPLAY_NAME_MAPPINGS = {
     "Raffle": "Raffle",
+    "RaffleBatch": "Raffle Batch",  # Add the batch raffle display name
+    "RaffleSimilar": "Raffle Similar",  # Add the similarity search display name
     "PreviewHistory": "Preview History (Raffle)",  # Add the renamed display name
     "TagCategoryStrength": "Tag Category Strength (Raffle)",  # Add the new display name
     "CurvedRescaleCFG": "Curved Rescale CFG (Raffle)"  # Add the curved rescale cfg display name
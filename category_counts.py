@@ -0,0 +1,164 @@
+import os
+import re
+import time
+import threading
+from array import array
+from itertools import compress
+
+from .tag_columns import to_lanes
+from .taglist_index import INDEX_CACHE_PATH, _read_index_file, _write_index_file
+
+# Name that stands for the tags left after exclude_tag_categories in category_constraints
+SURVIVING_TAGS = "surviving"
+# Counts are compared in 16-bit lanes of a big integer; they stay below this bit, so lanes never carry
+LANE_HIGH_BIT = 0x8000
+
+_CONSTRAINT_PATTERN = re.compile(r'([^\s<>=!]+)\s*(>=|<=|!=|=|>|<)\s*(\d+)\Z')
+
+
+def build_category_counts(taglist_file, category_registry):
+    """
+    Category statistics of every taglist in a file:
+    - counts: how many tags of each category every taglist has, one column of line_count values per category id
+    - totals: how many categorized tags every taglist has
+    """
+    line_count = taglist_file.line_count
+    category_count = len(category_registry.category_names)
+    tag_info = category_registry.tag_info
+
+    counts = array('H', bytes(2 * line_count * category_count))
+    totals = array('H', bytes(2 * line_count))
+    # Walking the posting lists of the categorized tags visits every (taglist, tag) pair once, without decoding lines
+    for tag in taglist_file.vocabulary:
+        info = tag_info.get(tag)
+        if info is None:
+            continue
+        category_id = info[0]
+        column_start = category_id * line_count
+        for line_id in taglist_file.get_postings(tag):
+            counts[column_start + line_id] += 1
+            totals[line_id] += 1
+    return {"counts": counts, "totals": totals}
+
+
+def _category_counts_path(taglist_file):
+    return os.path.join(INDEX_CACHE_PATH, os.path.basename(taglist_file.filepath) + ".categories")
+
+
+# Category statistics per taglist file, for the file and categorized_tags.txt versions they were built from
+_category_counts = {}
+_category_counts_lock = threading.Lock()
+
+
+def get_category_counts(taglist_file, category_registry, build=True):
+    """
+    Category statistics of a TaglistFile (see build_category_counts).
+    They are cached next to the taglist index and rebuilt when the list file or categorized_tags.txt changes.
+    With build=False, None is returned instead of building them.
+    """
+    version = (taglist_file.stamp, category_registry.mtime_ns)
+    with _category_counts_lock:
+        cached = _category_counts.get(taglist_file.filepath)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        header = dict(taglist_file.stamp, line_count=taglist_file.line_count,
+                      categories_mtime_ns=category_registry.mtime_ns,
+                      category_count=len(category_registry.category_names))
+        path = _category_counts_path(taglist_file)
+        loaded = _read_index_file(path)
+        if loaded is not None and all(loaded[0].get(k) == v for k, v in header.items()):
+            category_counts = loaded[1]
+        elif not build:
+            return None
+        else:
+            start = time.perf_counter()
+            category_counts = build_category_counts(taglist_file, category_registry)
+            print(f"[Raffle] Counted the tag categories of {taglist_file.filename} ({time.perf_counter() - start:.1f}s)")
+            try:
+                _write_index_file(path, header, category_counts)
+            except OSError as e:
+                print(f"[Raffle] Could not save tag category counts for {taglist_file.filename}: {e}")
+
+        _category_counts[taglist_file.filepath] = (version, category_counts)
+        return category_counts
+
+
+def parse_category_constraints(text, category_registry):
+    """
+    Parse constraints such as 'poses >= 3, surviving >= 8' (separated by commas or newlines) into a tuple
+    of (category id or SURVIVING_TAGS, operator, count). Raises ValueError for a malformed constraint.
+    """
+    constraints = []
+    for part in text.replace('\n', ',').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        match = _CONSTRAINT_PATTERN.match(part)
+        if match is None:
+            raise ValueError(f"Invalid category constraint '{part}', expected e.g. 'poses >= 3' or 'surviving >= 8'")
+        name, operator, count = match.groups()
+        if name != SURVIVING_TAGS:
+            if name not in category_registry.category_ids:
+                raise ValueError(f"Invalid category constraint '{part}': unknown category '{name}'")
+            name = category_registry.category_ids[name]
+        constraints.append((name, operator, int(count)))
+    return tuple(constraints)
+
+
+def _at_least(lanes, count, ones):
+    """1 in every lane holding at least count, else 0"""
+    if count <= 0:
+        return ones
+    # Adding LANE_HIGH_BIT - count sets a lane's high bit exactly when the lane is at least count
+    count = min(count, LANE_HIGH_BIT)
+    return ((lanes + ones * (LANE_HIGH_BIT - count)) >> 15) & ones
+
+
+def _compare(lanes, operator, count, ones):
+    """1 in every lane that satisfies the comparison, else 0"""
+    if operator == ">=":
+        return _at_least(lanes, count, ones)
+    if operator == ">":
+        return _at_least(lanes, count + 1, ones)
+    if operator == "<=":
+        return ones ^ _at_least(lanes, count + 1, ones)
+    if operator == "<":
+        return ones ^ _at_least(lanes, count, ones)
+    equal = _at_least(lanes, count, ones) ^ _at_least(lanes, count + 1, ones)
+    return equal if operator == "=" else ones ^ equal
+
+
+def filter_by_category_constraints(taglist_file, line_ids, constraints, category_registry, allowed_category_ids):
+    """
+    The line ids of a pool whose taglists satisfy every category constraint.
+    The comparisons run on whole columns of counts packed into big integers, so each one costs a few
+    passes over the column in C instead of a Python loop over the taglists. SURVIVING_TAGS counts the categorized tags
+    of the allowed categories, i.e. the tags a selected taglist keeps after exclude_tag_categories.
+    """
+    category_counts = get_category_counts(taglist_file, category_registry)
+    counts = category_counts["counts"]
+    line_count = taglist_file.line_count
+    if not line_count:
+        return array('I')
+    ones = to_lanes(array('H', [1]) * line_count)
+
+    passed = ones
+    for name, operator, count in constraints:
+        if name == SURVIVING_TAGS:
+            lanes = to_lanes(category_counts["totals"])
+            for category_id in range(len(category_registry.category_names)):
+                if category_id not in allowed_category_ids:
+                    lanes -= to_lanes(counts[category_id * line_count:(category_id + 1) * line_count])
+        else:
+            lanes = to_lanes(counts[name * line_count:(name + 1) * line_count])
+        passed &= _compare(lanes, operator, count, ones)
+        if not passed:
+            return array('I')
+
+    flags = array('H')
+    flags.frombytes(passed.to_bytes(2 * line_count, 'little'))
+    if len(line_ids) == line_count:
+        # An unfiltered pool holds every line id in order
+        return array('I', compress(range(line_count), flags))
+    return array('I', compress(line_ids, map(flags.__getitem__, line_ids)))
@@ -0,0 +1,321 @@
+import os
+import re
+import threading
+from array import array
+
+from .mapped_tables import vocabulary_arrays, MappedVocabulary, MappedTagIds
+from .clip_tokens import ClipTokenCounter, clip_vocabulary_path, token_count_source
+from .taglist_index import (INDEX_CACHE_PATH, _read_index_file, _write_index_file, _source_stamp,
+                            _index_build_lock)
+
+# --- Constants ---
+EXTENSION_PATH = os.path.normpath(os.path.dirname(__file__))
+CATEGORIZED_TAGS_PATH = os.path.join(EXTENSION_PATH, "lists", "categorized_tags.txt")
+# Compiled, memory-mapped form of categorized_tags.txt
+REGISTRY_INDEX_PATH = os.path.join(INDEX_CACHE_PATH, "categorized_tags.index")
+
+# Tags wrapped in this are regular expressions in filter_out_tags and negative_prompt ('/.*_condom/').
+# No categorized tag starts and ends with it, unlike 're:' (re:zero_kara_hajimeru_isekai_seikatsu, re:act, ...)
+TAG_REGEX_DELIMITER = "/"
+# How many distinct filter lists keep their expanded tag set cached
+PATTERN_CACHE_SIZE = 64
+
+# Global list of all available categories - used by both Raffle and TagCategoryStrength
+ALL_CATEGORIES = [
+    'abstract_symbols',
+    'actions',
+    'artstyle_technique',
+    'artist',
+    'background_objects',
+    'bodily_fluids',
+    'camera_angle_perspective',
+    'camera_focus_subject',
+    'camera_framing_composition',
+    'character_count',
+    'character_name',
+    'clothes_and_accessories',
+    'color_scheme',
+    'content_censorship_methods',
+    'copyright',
+    'expressions_and_mental_state',
+    'female_intimate_anatomy',
+    'female_physical_descriptors',
+    'format_and_presentation',
+    'gaze_direction_and_eye_contact',
+    'general_clothing_exposure',
+    'generic_clothing_interactions',
+    'holding_large_items',
+    'holding_small_items',
+    'intentional_design_exposure',
+    'lighting_and_vfx',
+    'male_intimate_anatomy',
+    'male_physical_descriptors',
+    'meta',
+    'metadata_and_attribution',
+    'named_garment_exposure',
+    'nudity_and_absence_of_clothing',
+    'one_handed_character_items',
+    'physical_locations',
+    'poses',
+    'publicly_visible_anatomy',
+    'relationships',
+    'sex_acts',
+    'sfw_clothed_anatomy',
+    'special_backgrounds',
+    'specific_garment_interactions',
+    'speech_and_text',
+    'standard_physical_descriptors',
+    'thematic_settings',
+    'two_handed_character_items'
+]
+
+
+class MappedTagInfo:
+    """
+    Read-only tag -> (category id, rank) mapping over the compiled registry index, with the dict methods
+    the registry uses. A tag's id in the index is its position in categorized_tags.txt, so it is also its rank.
+    """
+
+    def __init__(self, arrays):
+        self.vocabulary = MappedVocabulary(arrays)
+        self.tag_ids = MappedTagIds(arrays, self.vocabulary)
+        self.tag_categories = arrays["tag_categories"]
+
+    def get(self, tag, default=None):
+        tag_id = self.tag_ids.get(tag)
+        if tag_id is None:
+            return default
+        return self.tag_categories[tag_id], tag_id
+
+    def __contains__(self, tag):
+        return self.tag_ids.get(tag) is not None
+
+    def __iter__(self):
+        return iter(self.vocabulary)
+
+    def __len__(self):
+        return len(self.vocabulary)
+
+
+class CategoryRegistry:
+    """
+    Parsed form of categorized_tags.txt, shared by every node.
+
+    Category ids are positions in ALL_CATEGORIES (categories only found in the file are appended after them),
+    and a tag's rank is its line position in the file, which is the order Raffle outputs tags in.
+    The parsed file is compiled into REGISTRY_INDEX_PATH and memory-mapped, so ComfyUI processes
+    running side by side share one copy of it instead of each parsing the file into its own dicts.
+    The CLIP token count of every tag is compiled into it too, for trimming outputs to a token budget.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.mtime_ns = os.stat(filepath).st_mtime_ns
+        stamp = _source_stamp(filepath)
+
+        loaded = self._load_index(stamp)
+        if loaded is None:
+            with _index_build_lock(REGISTRY_INDEX_PATH):
+                # Another process may have compiled it while this one waited for the lock
+                loaded = self._load_index(stamp)
+                if loaded is None:
+                    loaded = self._build_index(stamp)
+
+        header, arrays = loaded
+        self.category_names = header["categories"]
+        self.category_ids = {category: category_id for category_id, category in enumerate(self.category_names)}
+        # tag -> (category id, rank)
+        self.tag_info = MappedTagInfo(arrays)
+        # rank -> CLIP tokens of the tag, and whether they were counted with CLIP's BPE or estimated
+        self.tag_tokens = arrays["tag_tokens"]
+        self.token_count_source = header["token_counts"]
+        # Tuple of filter tags/patterns -> expanded set of tags
+        self._pattern_cache = {}
+        # category name -> frozenset of its tags, built on first use (see get_category_tags)
+        self._category_tags = None
+
+    def _load_index(self, stamp):
+        """Map the compiled registry if it was built from the current categorized_tags.txt, else None"""
+        loaded = _read_index_file(REGISTRY_INDEX_PATH)
+        if loaded is None:
+            return None
+        header, arrays = loaded
+        if any(header.get(k) != v for k, v in stamp.items()) or header.get("source_path") != self.filepath:
+            return None
+        if header.get("token_counts") != token_count_source():
+            return None
+        return loaded
+
+    def _build_index(self, stamp):
+        """Parse categorized_tags.txt and save it as a compiled index. Returns (header, arrays)."""
+        category_names = list(ALL_CATEGORIES)
+        category_ids = {category: category_id for category_id, category in enumerate(category_names)}
+        tags = []
+        seen_tags = set()
+        tag_categories = array('H')
+
+        try:
+            with open(self.filepath, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+
+                    # Parse format: [category] tag
+                    parts = line.split('] ', 1)
+                    if len(parts) != 2:
+                        continue
+
+                    category = parts[0][1:]  # Remove the leading [
+                    tag = parts[1]
+                    if tag in seen_tags:
+                        continue
+
+                    category_id = category_ids.get(category)
+                    if category_id is None:
+                        category_id = category_ids[category] = len(category_names)
+                        category_names.append(category)
+
+                    seen_tags.add(tag)
+                    tags.append(tag)
+                    tag_categories.append(category_id)
+        except Exception as e:
+            raise ValueError(f"Error reading categorized tags file: {str(e)}")
+
+        token_counter = ClipTokenCounter(clip_vocabulary_path())
+        tag_tokens = array('B', map(token_counter.count, tags))
+
+        header = dict(stamp, source_path=self.filepath, categories=category_names, token_counts=token_count_source())
+        arrays = dict(vocabulary_arrays(tags), tag_categories=tag_categories, tag_tokens=tag_tokens)
+        try:
+            _write_index_file(REGISTRY_INDEX_PATH, header, arrays)
+        except OSError as e:
+            print(f"[Raffle] Could not save the compiled categorized tags: {e}")
+            return header, arrays
+        # Map the written file, so this process shares its pages with every other one
+        return _read_index_file(REGISTRY_INDEX_PATH) or (header, arrays)
+
+    def is_stale(self):
+        """True if categorized_tags.txt changed on disk since it was parsed"""
+        try:
+            return os.stat(self.filepath).st_mtime_ns != self.mtime_ns
+        except OSError:
+            return True
+
+    def expand_tag_patterns(self, tags):
+        """
+        The set of tags with every pattern replaced by the categorized tags it matches.
+        '*' matches any run of characters ('*_condom*'), and a regular expression between slashes
+        has to match the whole tag ('/.*pubic_hair.*/'). Other tags, and any tag that is itself categorized,
+        are kept as they are.
+        Patterns only need to be matched against this vocabulary, as every output tag is a categorized tag,
+        and the result is cached per list of tags, so an unchanged filter text costs one lookup.
+        """
+        tags = tuple(tags)
+        expanded = self._pattern_cache.get(tags)
+        if expanded is not None:
+            return expanded
+
+        expanded = set()
+        for tag in tags:
+            if tag in self.tag_info:
+                # A real tag is never read as a pattern
+                expanded.add(tag)
+                continue
+            if len(tag) > 2 and tag.startswith(TAG_REGEX_DELIMITER) and tag.endswith(TAG_REGEX_DELIMITER):
+                try:
+                    match = re.compile(tag[1:-1]).fullmatch
+                except re.error as e:
+                    raise ValueError(f"Invalid tag pattern '{tag}': {e}")
+                expanded.update(filter(match, self.tag_info))
+            elif '*' in tag:
+                vocabulary = self.tag_info.vocabulary
+                expanded.update(map(vocabulary.__getitem__, vocabulary.find(tag)))
+            else:
+                expanded.add(tag)
+
+        expanded = frozenset(expanded)
+        if len(self._pattern_cache) >= PATTERN_CACHE_SIZE:
+            self._pattern_cache.clear()
+        self._pattern_cache[tags] = expanded
+        return expanded
+
+    def get_category(self, tag):
+        """Category name of a tag, or None if the tag isn't categorized"""
+        info = self.tag_info.get(tag)
+        return self.category_names[info[0]] if info is not None else None
+
+    def get_category_tags(self, category):
+        """
+        Frozenset of the tags in a category (empty for an unknown name).
+        The sets are built in one pass over the mapped registry the first time any category is asked for,
+        so processes that never need them don't pay for them.
+        """
+        category_tags = self._category_tags
+        if category_tags is None:
+            tags_by_id = [[] for _ in self.category_names]
+            for tag, category_id in zip(self.tag_info.vocabulary, self.tag_info.tag_categories):
+                tags_by_id[category_id].append(tag)
+            category_tags = {
+                category: frozenset(tags) for category, tags in zip(self.category_names, tags_by_id)
+            }
+            # Built whole before it's published, so threads racing here just build it twice
+            self._category_tags = category_tags
+        return category_tags.get(category, frozenset())
+
+    def get_category_ids(self, categories):
+        """Set of category ids for the given category names (unknown names are ignored)"""
+        return {self.category_ids[category] for category in categories if category in self.category_ids}
+
+    def filter_and_order(self, tags, allowed_category_ids):
+        """Keep the tags whose category is allowed, sorted into categorized_tags.txt order"""
+        ranked_tags = []
+        tag_info = self.tag_info
+        for tag in tags:
+            info = tag_info.get(tag)
+            if info is not None and info[0] in allowed_category_ids:
+                ranked_tags.append((info[1], tag))
+        ranked_tags.sort()
+        return [tag for _, tag in ranked_tags]
+
+    def trim_to_token_budget(self, tags, token_budget, category_priority):
+        """
+        Drop tags until ', '.join(tags) fits in token_budget CLIP tokens. Returns (kept tags, tokens used).
+        Tags are kept in order of category_priority (category id -> position, lower first, with unlisted
+        categories after the listed ones) and then of their order in tags. A tag that doesn't fit is
+        skipped, so shorter tags after it can still use what is left of the budget.
+        Kept tags stay in their original order. Every tag has to be categorized, as filter_and_order ensures.
+        """
+        tag_info = self.tag_info
+        unlisted = len(category_priority)
+        ranked_tags = []
+        for position, tag in enumerate(tags):
+            category_id, rank = tag_info.get(tag)
+            ranked_tags.append((category_priority.get(category_id, unlisted), position, rank))
+        ranked_tags.sort()
+
+        tag_tokens = self.tag_tokens
+        kept = bytearray(len(tags))
+        # Every tag after the first also costs the comma in front of it
+        used = -1
+        for _, position, rank in ranked_tags:
+            cost = tag_tokens[rank] + 1
+            if used + cost <= token_budget:
+                used += cost
+                kept[position] = 1
+        return [tag for tag, keep in zip(tags, kept) if keep], max(used, 0)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_category_registry():
+    """Return the shared CategoryRegistry, re-parsing categorized_tags.txt only when it has changed"""
+    global _registry
+    with _registry_lock:
+        if _registry is None or _registry.is_stale():
+            if not os.path.exists(CATEGORIZED_TAGS_PATH):
+                raise ValueError(f"Categorized tags file not found at {CATEGORIZED_TAGS_PATH}")
+            _registry = CategoryRegistry(CATEGORIZED_TAGS_PATH)
+        return _registry
@@ -0,0 +1,112 @@
+import os
+import re
+import gzip
+import importlib.util
+
+# A CLIP merges.txt, bpe_simple_vocab_16e6.txt.gz or a folder holding a merges.txt, used instead of ComfyUI's
+CLIP_VOCABULARY_ENV = "RAFFLE_CLIP_VOCAB"
+# Number of merges CLIP uses from its BPE vocabulary (49152 tokens minus 256 bytes and 2 special tokens)
+CLIP_MERGE_COUNT = 49152 - 256 - 2
+# Token counts are stored in one byte per tag
+MAX_TAG_TOKENS = 255
+
+# CLIP's pre-tokenizer with the standard re module: contractions, letter runs, single digits and other symbol runs
+# (an underscore is neither a letter nor a digit to CLIP, so 'long_hair' is 'long', '_', 'hair')
+_PIECE_PATTERN = re.compile(r"'s|'t|'re|'ve|'m|'ll|'d|[^\W\d_]+|\d|(?:[^\s\w]|_)+", re.IGNORECASE)
+
+
+def clip_vocabulary_path():
+    """
+    The CLIP BPE merges to count tokens with: RAFFLE_CLIP_VOCAB if set, else the copy ComfyUI ships
+    for its SD1 tokenizer. None if neither exists (e.g. outside ComfyUI), then counts are estimated.
+    """
+    path = os.environ.get(CLIP_VOCABULARY_ENV)
+    if not path:
+        try:
+            spec = importlib.util.find_spec("comfy")
+        except (ImportError, ValueError):
+            spec = None
+        if spec is None or not spec.submodule_search_locations:
+            return None
+        path = os.path.join(list(spec.submodule_search_locations)[0], "sd1_tokenizer")
+    if os.path.isdir(path):
+        path = os.path.join(path, "merges.txt")
+    return path if os.path.isfile(path) else None
+
+
+def token_count_source():
+    """What token counts are based on here, stored with them so they are redone when it changes"""
+    return clip_vocabulary_path() or "estimate"
+
+
+def _bytes_to_unicode():
+    """CLIP's reversible mapping of every byte to a printable character"""
+    printable = list(range(ord("!"), ord("~") + 1)) + list(range(ord("¡"), ord("¬") + 1)) + list(range(ord("®"), ord("ÿ") + 1))
+    characters = printable[:]
+    extra = 0
+    for byte in range(256):
+        if byte not in printable:
+            printable.append(byte)
+            characters.append(256 + extra)
+            extra += 1
+    return {byte: chr(character) for byte, character in zip(printable, characters)}
+
+
+class ClipTokenCounter:
+    """
+    Counts the CLIP tokens of a tag with CLIP's byte pair encoding, from the merges alone:
+    the number of tokens is the number of symbols left after merging, so the vocabulary itself isn't needed.
+    Without merges every letter run is estimated at one token per 5 letters.
+    """
+
+    def __init__(self, merges_path=None):
+        self.merges_path = merges_path
+        self.ranks = None
+        if merges_path is not None:
+            opener = gzip.open if merges_path.endswith(".gz") else open
+            with opener(merges_path, 'rt', encoding='utf-8') as f:
+                lines = f.read().split('\n')
+            # The first line is a version comment
+            merges = [tuple(line.split()) for line in lines[1:CLIP_MERGE_COUNT + 1]]
+            self.ranks = {merge: rank for rank, merge in enumerate(merges)}
+        self.byte_encoder = _bytes_to_unicode()
+        # Word piece -> token count; tags share most of their words
+        self._piece_tokens = {}
+
+    def _bpe_length(self, piece):
+        """Number of BPE tokens of one pre-tokenized piece"""
+        word = tuple(self.byte_encoder[byte] for byte in piece.encode('utf-8'))
+        word = word[:-1] + (word[-1] + '</w>',)
+        ranks = self.ranks
+        while len(word) > 1:
+            best = min(zip(word, word[1:]), key=lambda pair: ranks.get(pair, CLIP_MERGE_COUNT))
+            if best not in ranks:
+                break
+            first, second = best
+            merged = []
+            position = 0
+            while position < len(word):
+                if position < len(word) - 1 and word[position] == first and word[position + 1] == second:
+                    merged.append(first + second)
+                    position += 2
+                else:
+                    merged.append(word[position])
+                    position += 1
+            word = tuple(merged)
+        return len(word)
+
+    def count(self, text):
+        """CLIP tokens of a text, not counting the start and end tokens"""
+        tokens = 0
+        for piece in _PIECE_PATTERN.findall(' '.join(text.lower().split())):
+            piece_tokens = self._piece_tokens.get(piece)
+            if piece_tokens is None:
+                if self.ranks is not None:
+                    piece_tokens = self._bpe_length(piece)
+                elif piece[0].isalpha():
+                    piece_tokens = (len(piece) + 4) // 5
+                else:
+                    piece_tokens = 1
+                self._piece_tokens[piece] = piece_tokens
+            tokens += piece_tokens
+        return min(tokens, MAX_TAG_TOKENS)
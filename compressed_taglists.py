@@ -0,0 +1,155 @@
+# Compressed, dictionary-encoded storage for taglists-*.txt files.
+#
+# A compressed list (taglists-<rating>.txt.gz, or .txt.zst when the optional zstandard package is installed)
+# holds the tag vocabulary once, followed by blocks of taglists where every tag is stored as an integer id.
+# Blocks are plain arrays, so they are decoded straight from the decompression stream without parsing text.
+#
+# Stream layout (little-endian):
+#     magic, format version (uint32)
+#     vocabulary tag count (uint64), byte length (uint64), vocabulary as newline separated utf-8
+#     blocks of: line count (uint32), tag id count (uint32),
+#                has_meta (uint8 per line), post_id (uint64 per line), score (int64 per line),
+#                tag count (uint32 per line), tag ids (uint32 per tag)
+#     a block with a line count of 0 marks the end
+import gzip
+import struct
+import sys
+from array import array
+from collections import Counter
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSED_MAGIC = b"RAFFLETL"
+COMPRESSED_VERSION = 1
+LINES_PER_BLOCK = 4096
+
+# Extensions in order of preference
+COMPRESSED_EXTENSIONS = (".zst", ".gz")
+
+
+def _split_line(line):
+    """Split a taglist line into (has_meta, post_id, score, tags), matching taglist_index.split_taglist"""
+    fields = [field.strip() for field in line.split(',')]
+    if len(fields) >= 2 and fields[0].isdigit() and fields[1].lstrip('-').isdigit():
+        return True, int(fields[0]), int(fields[1]), fields[2:]
+    return False, 0, 0, fields
+
+
+def _to_little_endian(values):
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_little_endian(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def _read_exact(stream, size):
+    """Read exactly size bytes from a decompression stream, which may return short reads"""
+    chunks = []
+    remaining = size
+    while remaining:
+        chunk = stream.read(remaining)
+        if not chunk:
+            raise ValueError("Compressed taglist file is truncated")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+
+def open_compressed(path, mode='rb'):
+    """Open a .gz or .zst file as a binary stream"""
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise ValueError(f"Reading {path} requires the zstandard package (pip install zstandard)")
+        if mode == 'rb':
+            return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+        return zstandard.ZstdCompressor(level=19).stream_writer(open(path, 'wb'), closefd=True)
+    return gzip.open(path, mode, compresslevel=9) if mode == 'wb' else gzip.open(path, mode)
+
+
+def write_compressed_taglists(txt_path, out_path):
+    """Convert a taglists-*.txt file into the compressed format. Returns the number of taglists written"""
+    # First pass: vocabulary ordered by frequency, so common tags get small ids
+    frequencies = Counter()
+    with open(txt_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                frequencies.update(_split_line(line.strip())[3])
+    vocabulary = [tag for tag, _ in frequencies.most_common()]
+    tag_ids = {tag: tag_id for tag_id, tag in enumerate(vocabulary)}
+    vocabulary_bytes = '\n'.join(vocabulary).encode('utf-8')
+
+    line_count = 0
+    with open_compressed(out_path, 'wb') as out, open(txt_path, 'r', encoding='utf-8') as f:
+        out.write(COMPRESSED_MAGIC)
+        out.write(struct.pack('<IQQ', COMPRESSED_VERSION, len(vocabulary), len(vocabulary_bytes)))
+        out.write(vocabulary_bytes)
+
+        def write_block(block):
+            out.write(struct.pack('<II', len(block), sum(len(tags) for _, _, _, tags in block)))
+            out.write(_to_little_endian(array('B', (has_meta for has_meta, _, _, _ in block))))
+            out.write(_to_little_endian(array('Q', (post_id for _, post_id, _, _ in block))))
+            out.write(_to_little_endian(array('q', (score for _, _, score, _ in block))))
+            out.write(_to_little_endian(array('I', (len(tags) for _, _, _, tags in block))))
+            out.write(_to_little_endian(array('I', (tag_ids[tag] for _, _, _, tags in block for tag in tags))))
+
+        block = []
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            block.append(_split_line(line))
+            line_count += 1
+            if len(block) == LINES_PER_BLOCK:
+                write_block(block)
+                block = []
+        if block:
+            write_block(block)
+        out.write(struct.pack('<II', 0, 0))
+
+    return line_count
+
+
+def read_compressed_taglists(path):
+    """
+    Stream a compressed taglist file.
+    Returns the vocabulary and a generator of blocks (has_meta, post_ids, scores, tag_counts, tag_ids) as arrays.
+    """
+    stream = open_compressed(path, 'rb')
+    try:
+        if _read_exact(stream, len(COMPRESSED_MAGIC)) != COMPRESSED_MAGIC:
+            raise ValueError(f"{path} is not a compressed taglist file")
+        version, vocabulary_count, vocabulary_length = struct.unpack('<IQQ', _read_exact(stream, 20))
+        if version != COMPRESSED_VERSION:
+            raise ValueError(f"{path} uses unsupported format version {version}")
+        vocabulary_bytes = _read_exact(stream, vocabulary_length)
+        vocabulary = vocabulary_bytes.decode('utf-8').split('\n')[:vocabulary_count]
+    except Exception:
+        stream.close()
+        raise
+
+    def blocks():
+        with stream:
+            while True:
+                line_count, id_count = struct.unpack('<II', _read_exact(stream, 8))
+                if line_count == 0:
+                    return
+                yield (
+                    _from_little_endian('B', _read_exact(stream, line_count)),
+                    _from_little_endian('Q', _read_exact(stream, line_count * 8)),
+                    _from_little_endian('q', _read_exact(stream, line_count * 8)),
+                    _from_little_endian('I', _read_exact(stream, line_count * 4)),
+                    _from_little_endian('I', _read_exact(stream, id_count * 4)),
+                )
+
+    return vocabulary, blocks()
@@ -1,5 +1,3 @@
-import torch
-
 class CurvedRescaleCFG:
     @classmethod
     def INPUT_TYPES(s):
@@ -14,6 +12,9 @@ class CurvedRescaleCFG:
     CATEGORY = "advanced/model"
 
     def patch(self, model, multiplier, curve_peak_position, curve_sharpness):
+        # Imported here so loading the extension doesn't pull in torch
+        import torch
+
         def rescale_cfg_advanced_wrapper(args):
             nonlocal multiplier, curve_peak_position, curve_sharpness
 
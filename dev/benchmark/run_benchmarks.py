@@ -0,0 +1,224 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import importlib
+import statistics
+import subprocess
+
+from synthetic_corpus import generate_corpus, EXTENSION_PATH, RATINGS
+
+PACKAGE_NAME = "raffle_benchmark"
+
+# Minimal stand-ins for the ComfyUI modules the nodes import, so the benchmark runs outside ComfyUI
+FOLDER_PATHS_STUB = '''import os
+import tempfile
+
+_temp_directory = os.path.join(tempfile.gettempdir(), "raffle_benchmark_temp")
+
+def get_temp_directory():
+    os.makedirs(_temp_directory, exist_ok=True)
+    return _temp_directory
+
+def get_save_image_path(filename_prefix, output_dir, image_width=0, image_height=0):
+    os.makedirs(output_dir, exist_ok=True)
+    return output_dir, filename_prefix, 1, "", filename_prefix
+'''
+
+SERVER_STUB = '''class PromptServer:
+    instance = None
+'''
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=EXTENSION_PATH, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def setup_package(work_dir, corpus_dir):
+    """Copy the extension into work_dir as an importable package that reads its lists from corpus_dir"""
+    package_dir = os.path.join(work_dir, PACKAGE_NAME)
+    os.makedirs(os.path.join(package_dir, "lists"), exist_ok=True)
+    for filename in os.listdir(EXTENSION_PATH):
+        if filename.endswith(".py"):
+            shutil.copy(os.path.join(EXTENSION_PATH, filename), package_dir)
+    for filename in os.listdir(corpus_dir):
+        source = os.path.join(corpus_dir, filename)
+        target = os.path.join(package_dir, "lists", filename)
+        try:
+            os.symlink(source, target)
+        except OSError:
+            shutil.copy(source, target)
+
+    with open(os.path.join(work_dir, "folder_paths.py"), 'w') as f:
+        f.write(FOLDER_PATHS_STUB)
+    with open(os.path.join(work_dir, "server.py"), 'w') as f:
+        f.write(SERVER_STUB)
+
+    # Index warm-up would race with the timings below
+    os.environ["RAFFLE_WARMUP"] = "0"
+    sys.path.insert(0, work_dir)
+    return importlib.import_module(PACKAGE_NAME)
+
+
+def measure(function, repeat, setup=None):
+    """Run function repeat times and summarize the wall times in milliseconds"""
+    times = []
+    for iteration in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function(iteration)
+        times.append((time.perf_counter() - start) * 1000)
+    return {
+        "runs": repeat,
+        "min_ms": round(min(times), 4),
+        "median_ms": round(statistics.median(times), 4),
+        "mean_ms": round(statistics.fmean(times), 4),
+        "max_ms": round(max(times), 4),
+    }
+
+
+def benchmark_raffle(package, repeat):
+    raffle_module = importlib.import_module(f"{PACKAGE_NAME}.raffle")
+    batch_module = importlib.import_module(f"{PACKAGE_NAME}.raffle_batch")
+    taglist_index = importlib.import_module(f"{PACKAGE_NAME}.taglist_index")
+    Raffle = raffle_module.Raffle
+
+    settings = {
+        "exclude_taglists_containing": raffle_module.DEFAULT_EXCLUDE_TAGLISTS,
+        "taglists_must_include": raffle_module.DEFAULT_TAGLISTS_MUST_INCLUDE,
+        "filter_out_tags": raffle_module.DEFAULT_FILTER_OUT_TAGS,
+        "exclude_tag_categories": raffle_module.DEFAULT_EXCLUDE_CATEGORIES,
+        "use_general": True,
+        "use_questionable": True,
+        "use_sensitive": True,
+        "use_explicit": True,
+    }
+    raffle = Raffle()
+    results = {}
+
+    results["raffle_first_run"] = measure(lambda i: raffle.process_tags(seed=0, **settings), 1)
+    results["raffle_process_tags"] = measure(lambda i: raffle.process_tags(seed=i, **settings), repeat)
+    if "selection_mode" in Raffle.INPUT_TYPES()["optional"]:
+        results["raffle_process_tags_permutation"] = measure(
+            lambda i: raffle.process_tags(seed=i, selection_mode="permutation", **settings), repeat
+        )
+
+    # Without the pool cache every run filters the full corpus
+    if hasattr(Raffle, "_pool_cache"):
+        def clear_pool_cache():
+            Raffle._pool_cache = taglist_index.PoolCache()
+        results["raffle_process_tags_uncached_pool"] = measure(
+            lambda i: raffle.process_tags(seed=i, **settings), repeat, setup=clear_pool_cache
+        )
+
+    raffle_batch = batch_module.RaffleBatch()
+    results["raffle_batch_100"] = measure(lambda i: raffle_batch.process_batch(seed=i * 100, count=100, **settings), max(1, repeat // 10))
+    return results
+
+
+def benchmark_tag_category_strength(package, repeat):
+    module = importlib.import_module(f"{PACKAGE_NAME}.tag_category_strength")
+    node = module.TagCategoryStrength()
+    input_tags = ("1girl, solo, long_hair, (breasts:1.2), looking_at_viewer, smile, open_mouth, blush, "
+                  "short_hair, shirt, thighhighs, simple_background, skirt, hat, dress, bow, ribbon, "
+                  "holding, sitting, outdoors, standing, sky, day, cloud, from_side, upper_body")
+    adjustments = "(character_count:1.2), (female_physical_descriptors:0.8), (poses:1.3), (camera_framing_composition:1.1)"
+    return {
+        "tag_category_strength": measure(lambda i: node.adjust_tag_categories(input_tags, adjustments, True), repeat)
+    }
+
+
+def benchmark_torch_nodes(package, repeat):
+    """PreviewHistory and CurvedRescaleCFG need torch (and numpy/PIL); they are skipped when it isn't installed"""
+    try:
+        import torch
+        import numpy
+        import PIL
+    except ImportError as e:
+        reason = f"torch, numpy or PIL not installed ({e})"
+        return {"preview_history_execute": {"skipped": reason}, "curved_rescale_cfg_step": {"skipped": reason}}
+
+    torch.manual_seed(0)
+    results = {}
+
+    preview_module = importlib.import_module(f"{PACKAGE_NAME}.preview_history")
+    preview = preview_module.PreviewHistory()
+    image = torch.rand(1, 512, 512, 3)
+    results["preview_history_execute"] = measure(lambda i: preview.execute(image, 9), repeat)
+
+    cfg_module = importlib.import_module(f"{PACKAGE_NAME}.curved_rescale_cfg")
+
+    class StubModel:
+        def clone(self):
+            return StubModel()
+
+        def set_model_sampler_cfg_function(self, function):
+            self.cfg_function = function
+
+    (patched_model,) = cfg_module.CurvedRescaleCFG().patch(StubModel(), 0.7, 0.5, 2.1)
+    args = {
+        "cond": torch.randn(2, 4, 128, 128),
+        "uncond": torch.randn(2, 4, 128, 128),
+        "cond_scale": 7.0,
+        "sigma": torch.tensor([1.5, 1.5]),
+        "input": torch.randn(2, 4, 128, 128),
+    }
+    results["curved_rescale_cfg_step"] = measure(lambda i: patched_model.cfg_function(args), repeat)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Raffle nodes on a synthetic danbooru-scale corpus and print JSON results")
+    parser.add_argument("--lines", type=int, default=100000, help="taglists per rating file (default: 100000)")
+    parser.add_argument("--repeat", type=int, default=50, help="timed runs per benchmark (default: 50)")
+    parser.add_argument("--corpus", help="reuse (or create) the synthetic corpus in this folder instead of a temporary one")
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="raffle_benchmark_")
+    try:
+        corpus_dir = args.corpus or os.path.join(work_dir, "corpus")
+        corpus_start = time.perf_counter()
+        if not all(os.path.exists(os.path.join(corpus_dir, f"taglists-{rating}.txt")) for rating in RATINGS):
+            generate_corpus(corpus_dir, args.lines)
+        corpus_seconds = time.perf_counter() - corpus_start
+
+        package = setup_package(work_dir, corpus_dir)
+
+        results = {}
+        results.update(benchmark_raffle(package, args.repeat))
+        results.update(benchmark_tag_category_strength(package, args.repeat))
+        results.update(benchmark_torch_nodes(package, max(1, args.repeat // 5)))
+
+        report = {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "corpus": {
+                "lines_per_file": sum(1 for _ in open(os.path.join(corpus_dir, "taglists-general.txt"), encoding='utf-8')),
+                "files": len(RATINGS),
+                "generation_seconds": round(corpus_seconds, 2),
+            },
+            "results": results,
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
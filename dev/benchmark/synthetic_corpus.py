@@ -0,0 +1,76 @@
+import os
+import sys
+import random
+import shutil
+import itertools
+
+# Paths inside the repository
+EXTENSION_PATH = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+ALL_TAGS_PATH = os.path.join(EXTENSION_PATH, "dev", "tag-scraper", "tag_lists", "all_tags.txt")
+CATEGORIZED_TAGS_PATH = os.path.join(EXTENSION_PATH, "lists", "categorized_tags.txt")
+
+RATINGS = ["general", "questionable", "sensitive", "explicit"]
+
+
+def read_tag_counts(path=ALL_TAGS_PATH):
+    """Read 'tag, count' lines into a list of (tag, count), most frequent first"""
+    tag_counts = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            parts = line.rsplit(',', 1)
+            if len(parts) != 2:
+                continue
+            try:
+                tag_counts.append((parts[0].strip(), int(parts[1])))
+            except ValueError:
+                continue
+    tag_counts.sort(key=lambda x: x[1], reverse=True)
+    return tag_counts
+
+
+def generate_taglists(path, lines, tag_counts, seed):
+    """
+    Write one synthetic taglists file in the real shape: 'post_id, score, tag, tag, ...' per line,
+    sorted by score. Tags are drawn proportionally to their danbooru post counts, which follow a Zipf
+    distribution, and each taglist gets a realistic number of tags.
+    """
+    rng = random.Random(seed)
+    tags = [tag for tag, _ in tag_counts]
+    cum_weights = list(itertools.accumulate(count for _, count in tag_counts))
+
+    rows = []
+    for _ in range(lines):
+        tag_count = min(120, max(3, int(rng.gauss(32, 12))))
+        taglist = set(rng.choices(tags, cum_weights=cum_weights, k=tag_count))
+        post_id = rng.randint(1, 9000000)
+        # Scores are heavy-tailed, like the scraped posts
+        score = int(rng.paretovariate(1.5) * 20)
+        rows.append((score, post_id, sorted(taglist)))
+
+    rows.sort(key=lambda row: row[0], reverse=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        for score, post_id, taglist in rows:
+            f.write(f"{post_id}, {score}, {', '.join(taglist)}\n")
+
+
+def generate_corpus(output_dir, lines_per_file=100000, seed=0):
+    """Write taglists-<rating>.txt for every rating plus categorized_tags.txt into output_dir"""
+    os.makedirs(output_dir, exist_ok=True)
+    tag_counts = read_tag_counts()
+    for rating_number, rating in enumerate(RATINGS):
+        generate_taglists(os.path.join(output_dir, f"taglists-{rating}.txt"), lines_per_file, tag_counts, seed + rating_number)
+    shutil.copy(CATEGORIZED_TAGS_PATH, os.path.join(output_dir, "categorized_tags.txt"))
+
+
+def main():
+    # Usage: python synthetic_corpus.py output_dir [lines_per_file]
+    if len(sys.argv) < 2:
+        print("Usage: python synthetic_corpus.py output_dir [lines_per_file]")
+        return
+    lines_per_file = int(sys.argv[2]) if len(sys.argv) >= 3 else 100000
+    generate_corpus(sys.argv[1], lines_per_file)
+    print(f"Wrote {len(RATINGS)} x {lines_per_file} taglists to {sys.argv[1]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import os
+import sys
+import time
+
+# compressed_taglists.py lives in the extension folder and has no dependencies on the rest of the extension
+EXTENSION_PATH = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, EXTENSION_PATH)
+from compressed_taglists import write_compressed_taglists, read_compressed_taglists, zstandard
+
+LISTS_PATH = os.path.join(EXTENSION_PATH, "lists")
+RATINGS = ["general", "questionable", "sensitive", "explicit"]
+
+
+def time_text_load(txt_path):
+    """Read and split every taglist of a plain text list, like an index build does"""
+    start = time.perf_counter()
+    tag_count = 0
+    with open(txt_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                tag_count += len(line.split(','))
+    return time.perf_counter() - start
+
+
+def time_compressed_load(compressed_path):
+    """Stream and decode every block of a compressed list"""
+    start = time.perf_counter()
+    vocabulary, blocks = read_compressed_taglists(compressed_path)
+    tag_count = 0
+    for _, _, _, tag_counts, tag_ids in blocks:
+        tag_count += len(tag_ids)
+    return time.perf_counter() - start
+
+
+def main():
+    # Usage: python compress-taglists.py [gz|zst]
+    extension = sys.argv[1] if len(sys.argv) >= 2 else ("zst" if zstandard is not None else "gz")
+    if extension not in ("gz", "zst"):
+        print("Usage: python compress-taglists.py [gz|zst]")
+        return
+    if extension == "zst" and zstandard is None:
+        print("The zstandard package is required for .zst output (pip install zstandard)")
+        return
+
+    for rating in RATINGS:
+        txt_path = os.path.join(LISTS_PATH, f"taglists-{rating}.txt")
+        if not os.path.exists(txt_path):
+            print(f"Skipping {txt_path} (not found)")
+            continue
+
+        compressed_path = f"{txt_path}.{extension}"
+        line_count = write_compressed_taglists(txt_path, compressed_path)
+
+        txt_size = os.path.getsize(txt_path)
+        compressed_size = os.path.getsize(compressed_path)
+        txt_time = time_text_load(txt_path)
+        compressed_time = time_compressed_load(compressed_path)
+
+        print(f"{os.path.basename(compressed_path)}: {line_count} taglists")
+        print(f"  size: {txt_size / 1024 / 1024:.1f} MB -> {compressed_size / 1024 / 1024:.1f} MB "
+              f"({compressed_size / txt_size:.1%})")
+        print(f"  load: {txt_time:.2f}s -> {compressed_time:.2f}s")
+
+    print("\nRaffle uses the compressed files instead of the .txt files as soon as they exist.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+import os
+import sys
+import time
+import types
+import importlib
+
+# near_duplicates.py uses relative imports, so the extension folder is registered as a package.
+# Its __init__ is not run: it needs ComfyUI (folder_paths) and starts the background index warm-up.
+EXTENSION_PATH = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+PACKAGE_NAME = "raffle_near_duplicates"
+package = types.ModuleType(PACKAGE_NAME)
+package.__path__ = [EXTENSION_PATH]
+sys.modules[PACKAGE_NAME] = package
+taglist_index = importlib.import_module(f"{PACKAGE_NAME}.taglist_index")
+near_duplicates = importlib.import_module(f"{PACKAGE_NAME}.near_duplicates")
+
+
+def main():
+    # Usage: python find-near-duplicates.py
+    # Builds the near-duplicate clusters of every taglist file ahead of time, so the first Raffle run
+    # with collapse_near_duplicates enabled doesn't have to
+    for filename in taglist_index.RATING_FILES.values():
+        if taglist_index.resolve_taglist_path(filename) is None:
+            print(f"Skipping {filename} (not found)")
+            continue
+
+        start = time.perf_counter()
+        taglist_file = taglist_index.get_taglist_file(filename)
+        representatives = near_duplicates.get_representatives(taglist_file)
+        cluster_count = sum(1 for line_id, representative in enumerate(representatives) if line_id == representative)
+        print(f"{filename}: {len(taglist_file)} taglists -> {cluster_count} after collapsing near-duplicates "
+              f"({time.perf_counter() - start:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+"""
+Builds and saves the index of one taglist file, in a worker process started by taglist_index.get_taglist_files:
+
+    python index_build_worker.py <filename> <filepath>
+
+It runs as a script in a fresh interpreter rather than as a multiprocessing worker: forking ComfyUI's
+multithreaded process is unsafe, and a spawned multiprocessing worker would import ComfyUI's main module again.
+The extension's modules are imported without running its __init__, which needs ComfyUI.
+"""
+import os
+import sys
+import types
+import importlib
+
+PACKAGE_NAME = "raffle_index_worker"
+
+
+def main(filename, filepath):
+    package = types.ModuleType(PACKAGE_NAME)
+    package.__path__ = [os.path.dirname(os.path.abspath(__file__))]
+    sys.modules[PACKAGE_NAME] = package
+    taglist_index = importlib.import_module(PACKAGE_NAME + ".taglist_index")
+    taglist_index._build_index_worker(filename, filepath)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit(f"Usage: python {os.path.basename(__file__)} <filename> <filepath>")
+    main(sys.argv[1], sys.argv[2])
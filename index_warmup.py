@@ -0,0 +1,57 @@
+import time
+import threading
+
+from .taglist_index import get_taglist_files, resolve_taglist_path, RATING_FILES
+from .category_registry import get_category_registry
+
+# How long process_tags waits for an unfinished warm-up before loading the indexes itself
+WARMUP_WAIT_TIMEOUT = 30.0
+
+_warmup_thread = None
+_warmup_started = None
+_warmup_elapsed = None
+_warmup_error = None
+
+
+def _warmup():
+    """Build or load the category registry and the index of every taglist file that exists"""
+    global _warmup_elapsed, _warmup_error
+    try:
+        get_category_registry()
+        get_taglist_files([filename for filename in RATING_FILES.values() if resolve_taglist_path(filename) is not None])
+    except Exception as e:
+        _warmup_error = e
+        print(f"[Raffle] Index warm-up failed: {e}")
+    _warmup_elapsed = time.perf_counter() - _warmup_started
+    if _warmup_error is None:
+        print(f"[Raffle] Index warm-up finished in {_warmup_elapsed:.2f}s")
+
+
+def start_warmup():
+    """Start loading Raffle's indexes on a daemon thread so it doesn't delay ComfyUI's startup"""
+    global _warmup_thread, _warmup_started
+    if _warmup_thread is not None:
+        return
+    _warmup_started = time.perf_counter()
+    _warmup_thread = threading.Thread(target=_warmup, name="RaffleIndexWarmup", daemon=True)
+    _warmup_thread.start()
+
+
+def wait_for_warmup(timeout=WARMUP_WAIT_TIMEOUT):
+    """
+    Wait for a running warm-up to finish. Returns straight away if no warm-up was started.
+    After the timeout the caller just carries on, loading whatever isn't ready yet itself.
+    """
+    if _warmup_thread is not None and _warmup_thread.is_alive():
+        _warmup_thread.join(timeout)
+
+
+def warmup_status():
+    """One line summary for the Debug info output"""
+    if _warmup_thread is None:
+        return "Index warm-up: disabled"
+    if _warmup_elapsed is None:
+        return f"Index warm-up: running for {time.perf_counter() - _warmup_started:.2f}s"
+    if _warmup_error is not None:
+        return f"Index warm-up: failed after {_warmup_elapsed:.2f}s ({_warmup_error})"
+    return f"Index warm-up: finished in {_warmup_elapsed:.2f}s"
@@ -0,0 +1,161 @@
+import re
+import zlib
+from array import array
+from bisect import bisect_left
+
+# Empty slot in a tag table
+EMPTY_SLOT = 0xffffffff
+
+
+def glob_to_regex(pattern):
+    """Compile a tag pattern where * matches any run of characters (and nothing else is special)"""
+    return re.compile('.*'.join(re.escape(part) for part in pattern.split('*')) + r'\Z')
+
+
+def glob_to_line_regex(pattern):
+    """
+    Compile a tag pattern (with something besides *) to find its tags in a newline separated UTF-8 vocabulary.
+    A match ends where its tag ends. Without a leading *, it starts at the newline before the tag, so the first
+    tag is never found. Not anchoring at line starts lets the regex engine skip ahead to the first literal, and
+    matching bytes finds the same tags as glob_to_regex, as a UTF-8 sequence never starts inside another one.
+    """
+    parts = [re.escape(part.encode('utf-8')) for part in pattern.split('*')]
+    if parts[0]:
+        parts[0] = b'\n' + parts[0]
+    else:
+        del parts[0]
+    return re.compile(b'[^\n]*'.join(parts) + b'$', re.MULTILINE)
+
+
+def vocabulary_arrays(vocabulary):
+    """
+    Pack a list of tags into arrays that can be memory-mapped and looked up in place:
+    - vocabulary: the UTF-8 tags, each followed by a newline, so a pattern can be matched in one regex pass
+    - vocabulary_offsets: where each tag starts, plus the end of the vocabulary
+    - tag_table: open addressing hash table (crc32, linear probing) of tag ids, at most half full
+    """
+    blob = bytearray()
+    offsets = array('Q', [0])
+    encoded_tags = []
+    for tag in vocabulary:
+        encoded = tag.encode('utf-8')
+        encoded_tags.append(encoded)
+        blob += encoded
+        blob += b'\n'
+        offsets.append(len(blob))
+
+    size = 8
+    while size < 2 * len(encoded_tags):
+        size *= 2
+    mask = size - 1
+    tag_table = array('I', [EMPTY_SLOT]) * size
+    for tag_id, encoded in enumerate(encoded_tags):
+        slot = zlib.crc32(encoded) & mask
+        while tag_table[slot] != EMPTY_SLOT:
+            slot = (slot + 1) & mask
+        tag_table[slot] = tag_id
+
+    return {
+        "vocabulary": array('B', blob),
+        "vocabulary_offsets": offsets,
+        "tag_table": tag_table,
+    }
+
+
+class MappedVocabulary:
+    """
+    Read-only list of tags over the arrays from vocabulary_arrays. Tags are decoded when accessed,
+    so a memory-mapped vocabulary stays in the shared page cache instead of every process's heap.
+    Tags added with append (e.g. from a delta segment) are kept in a normal list after the mapped ones.
+    """
+
+    def __init__(self, arrays):
+        # A memoryview compares equal to bytes whether it wraps a mapped index or a freshly built array
+        self.blob = memoryview(arrays["vocabulary"])
+        self.offsets = arrays["vocabulary_offsets"]
+        self.mapped_count = len(self.offsets) - 1
+        self.extra = []
+
+    def raw(self, tag_id):
+        """UTF-8 bytes of a mapped tag, without copying"""
+        return self.blob[self.offsets[tag_id]:self.offsets[tag_id + 1] - 1]
+
+    def find(self, pattern):
+        """
+        Ids of the tags matching a * pattern, in id order.
+        The mapped tags are matched in one pass of the regex engine over the blob, without decoding any of them.
+        """
+        if not pattern.strip('*'):
+            return list(range(len(self)))
+        match = glob_to_regex(pattern).match
+        tag_ids = []
+        if self.mapped_count:
+            offsets = self.offsets
+            # A match ends where its tag does, one byte (the newline) before the next tag's offset
+            tag_ids = [
+                bisect_left(offsets, found.end() + 1) - 1
+                for found in glob_to_line_regex(pattern).finditer(self.blob)
+            ]
+            if not pattern.startswith('*') and match(self[0]):
+                # The regex starts at the newline in front of a tag, which the first tag doesn't have
+                tag_ids.insert(0, 0)
+        tag_ids.extend(self.mapped_count + index for index, tag in enumerate(self.extra) if match(tag))
+        return tag_ids
+
+    def __len__(self):
+        return self.mapped_count + len(self.extra)
+
+    def __getitem__(self, tag_id):
+        if tag_id < 0:
+            tag_id += len(self)
+        if tag_id >= self.mapped_count:
+            return self.extra[tag_id - self.mapped_count]
+        return bytes(self.raw(tag_id)).decode('utf-8')
+
+    def __iter__(self):
+        # One decode and split of the whole blob is much faster than decoding the tags one by one
+        yield from str(self.blob, 'utf-8').split('\n')[:self.mapped_count]
+        yield from self.extra
+
+    def append(self, tag):
+        self.extra.append(tag)
+
+
+class MappedTagIds:
+    """
+    Read-only tag -> id mapping over a tag_table from vocabulary_arrays, with the dict methods the indexes use.
+    Ids set afterwards (tags only found in a delta segment) go into a normal dict.
+    """
+
+    def __init__(self, arrays, vocabulary):
+        self.table = arrays["tag_table"]
+        self.mask = len(self.table) - 1
+        self.vocabulary = vocabulary
+        self.extra = {}
+
+    def get(self, tag, default=None):
+        encoded = tag.encode('utf-8')
+        table, raw = self.table, self.vocabulary.raw
+        slot = zlib.crc32(encoded) & self.mask
+        while True:
+            tag_id = table[slot]
+            if tag_id == EMPTY_SLOT:
+                return self.extra.get(tag, default)
+            if raw(tag_id) == encoded:
+                return tag_id
+            slot = (slot + 1) & self.mask
+
+    def __contains__(self, tag):
+        return self.get(tag) is not None
+
+    def __getitem__(self, tag):
+        tag_id = self.get(tag)
+        if tag_id is None:
+            raise KeyError(tag)
+        return tag_id
+
+    def __setitem__(self, tag, tag_id):
+        self.extra[tag] = tag_id
+
+    def __len__(self):
+        return len(self.vocabulary)
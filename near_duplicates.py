@@ -0,0 +1,154 @@
+import os
+import time
+import random
+import hashlib
+import threading
+from array import array
+from operator import eq
+
+from .taglist_index import INDEX_CACHE_PATH, _read_index_file, _write_index_file
+
+# MinHash signature length; LSH splits it into bands of NEAR_DUPLICATE_BAND_ROWS hashes
+NEAR_DUPLICATE_HASHES = 32
+NEAR_DUPLICATE_BAND_ROWS = 4
+# Two taglists are near-duplicates when their estimated tag set (Jaccard) similarity is at least this
+NEAR_DUPLICATE_THRESHOLD = 0.8
+
+# Universal hashing mod a Mersenne prime, with fixed coefficients so cached results stay valid
+_MERSENNE_PRIME = (1 << 61) - 1
+_hash_rng = random.Random(0x5241464c45)
+_HASH_COEFFICIENTS = [
+    (_hash_rng.randrange(1, _MERSENNE_PRIME), _hash_rng.randrange(_MERSENNE_PRIME))
+    for _ in range(NEAR_DUPLICATE_HASHES)
+]
+
+
+def _tag_hashes(tag):
+    """The NEAR_DUPLICATE_HASHES MinHash values of a single tag"""
+    x = int.from_bytes(hashlib.blake2b(tag.encode('utf-8'), digest_size=8).digest(), 'little')
+    return array('I', (((a * x + b) % _MERSENNE_PRIME) & 0xffffffff for a, b in _HASH_COEFFICIENTS))
+
+
+def find_near_duplicates(taglist_file):
+    """
+    Cluster the near-duplicate taglists of a file with MinHash signatures and LSH banding.
+
+    Returns an array with the representative line id of every line: the first line (in file order,
+    so the highest scoring post) of its cluster. Lines that have no near-duplicate are their own representative.
+    """
+    hash_count = NEAR_DUPLICATE_HASHES
+    rows = NEAR_DUPLICATE_BAND_ROWS
+    line_count = taglist_file.line_count
+
+    # The signature of a taglist is the column-wise minimum of its tags' hashes
+    tag_hashes = [_tag_hashes(tag) for tag in taglist_file.vocabulary]
+    signatures = array('I')
+    has_tags = array('B')
+    empty_signature = array('I', bytes(4 * hash_count))
+    for line_tag_ids in taglist_file.iter_line_tag_ids():
+        if len(line_tag_ids):
+            signatures.extend(map(min, zip(*[tag_hashes[tag_id] for tag_id in set(line_tag_ids)])))
+            has_tags.append(1)
+        else:
+            signatures.extend(empty_signature)
+            has_tags.append(0)
+    del tag_hashes
+
+    # Union-find where the smaller line id always becomes the root
+    parents = array('I', range(line_count))
+
+    def find(line_id):
+        while parents[line_id] != line_id:
+            parents[line_id] = parents[parents[line_id]]
+            line_id = parents[line_id]
+        return line_id
+
+    minimum_matches = NEAR_DUPLICATE_THRESHOLD * hash_count
+    signature_bytes = memoryview(signatures).cast('B')
+    band_size = rows * 4
+    # Taglists that share all hashes of one band are candidates, confirmed by comparing the full signatures
+    for band_start in range(0, hash_count * 4, band_size):
+        first_in_bucket = {}
+        for line_id in range(line_count):
+            if not has_tags[line_id]:
+                continue
+            start = line_id * hash_count * 4 + band_start
+            first = first_in_bucket.setdefault(hash(signature_bytes[start:start + band_size].tobytes()), line_id)
+            if first == line_id:
+                continue
+            first_signature = signatures[first * hash_count:(first + 1) * hash_count]
+            line_signature = signatures[line_id * hash_count:(line_id + 1) * hash_count]
+            if sum(map(eq, first_signature, line_signature)) >= minimum_matches:
+                first_root, line_root = find(first), find(line_id)
+                if first_root != line_root:
+                    parents[max(first_root, line_root)] = min(first_root, line_root)
+
+    return array('I', map(find, range(line_count)))
+
+
+def _near_duplicates_path(taglist_file):
+    return os.path.join(INDEX_CACHE_PATH, os.path.basename(taglist_file.filepath) + ".neardup")
+
+
+def _cache_settings():
+    """Settings a cached result was built with; it is rebuilt when any of them change"""
+    return {
+        "hashes": NEAR_DUPLICATE_HASHES,
+        "band_rows": NEAR_DUPLICATE_BAND_ROWS,
+        "threshold": NEAR_DUPLICATE_THRESHOLD,
+    }
+
+
+# Representatives per taglist file, for the file version they were built from
+_representatives = {}
+_representatives_lock = threading.Lock()
+
+
+def get_representatives(taglist_file, build=True):
+    """
+    Representative line ids of a TaglistFile (see find_near_duplicates).
+    The result is cached next to the taglist index and only rebuilt when the list file changes.
+    With build=False, None is returned instead of building it.
+    """
+    with _representatives_lock:
+        cached = _representatives.get(taglist_file.filepath)
+        if cached is not None and cached[0] == taglist_file.stamp:
+            return cached[1]
+
+        header = dict(taglist_file.stamp, **_cache_settings())
+        path = _near_duplicates_path(taglist_file)
+        loaded = _read_index_file(path)
+        if loaded is not None and all(loaded[0].get(k) == v for k, v in header.items()):
+            representatives = loaded[1]["representatives"]
+        elif not build:
+            return None
+        else:
+            print(f"[Raffle] Finding near-duplicate taglists in {taglist_file.filename}, this only happens once per list file...")
+            start = time.perf_counter()
+            representatives = find_near_duplicates(taglist_file)
+            cluster_count = sum(1 for line_id, representative in enumerate(representatives) if line_id == representative)
+            print(f"[Raffle] {taglist_file.filename}: {len(representatives)} taglists in {cluster_count} clusters "
+                  f"({time.perf_counter() - start:.1f}s)")
+            try:
+                _write_index_file(path, header, {"representatives": representatives})
+            except OSError as e:
+                print(f"[Raffle] Could not save near-duplicates for {taglist_file.filename}: {e}")
+
+        _representatives[taglist_file.filepath] = (taglist_file.stamp, representatives)
+        return representatives
+
+
+def collapse_pool_duplicates(taglist_file, line_ids):
+    """
+    Keep one taglist of every near-duplicate cluster in a pool.
+    Pools are in file order, so the kept taglist is the highest scoring cluster member that passed the filters.
+    """
+    representatives = get_representatives(taglist_file)
+    seen = set()
+    collapsed = array('I')
+    for line_id in line_ids:
+        representative = representatives[line_id]
+        if representative not in seen:
+            seen.add(representative)
+            collapsed.append(line_id)
+    return collapsed
@@ -0,0 +1,154 @@
+import sys
+import time
+import asyncio
+
+from .raffle import Raffle, SELECTION_MODES, parse_rating_weights
+from .category_registry import ALL_CATEGORIES, get_category_registry
+from .category_counts import parse_category_constraints, get_category_counts
+from .taglist_index import RATING_FILES, get_loaded_taglist_file
+from .near_duplicates import get_representatives
+from .tag_query import parse_tag_query
+from .tag_tokenizer import tokenize_tags
+from .index_warmup import start_warmup, warmup_status
+from .weighted_sampling import SCORE_WEIGHTINGS, build_prefix_sums, alias_draw
+
+POOL_SIZE_ROUTE = "/raffle/pool_size"
+
+
+class IndexNotReady(Exception):
+    """An index the request needs isn't loaded, and requests never build one"""
+
+
+def _flag(fields, name):
+    """A boolean field. JSON booleans, 0/1 and the strings true/false are accepted, since bool("false") is True"""
+    value = fields.get(name, False)
+    if isinstance(value, str):
+        value = value.strip().lower()
+        if value in ("true", "1"):
+            return True
+        if value in ("false", "0", ""):
+            return False
+    elif value in (True, False, None):
+        return bool(value)
+    raise ValueError(f"{name} must be true or false, got {value!r}")
+
+
+def compute_pool_size(fields):
+    """
+    Pool size per rating file for the filter fields of a Raffle node, and the taglist the seed would pick.
+
+    Fields use the node's input names (exclude_taglists_containing, taglists_must_include, taglist_query,
+    use_general, ..., rating_weights, category_constraints, exclude_tag_categories, collapse_near_duplicates, seed, selection_mode,
+    score_weighting, score_temperature). Missing sampling fields take the node's defaults, missing use_* fields are off. Only indexes that are already loaded
+    are used and IndexNotReady is raised if one of them isn't, so a request never builds an index.
+    The pool goes into Raffle's pool cache, so queueing the same filters afterwards skips the filtering.
+    """
+    rating_weights = parse_rating_weights(str(fields.get("rating_weights", "")))
+    if rating_weights is not None:
+        filenames = [RATING_FILES[rating] for rating in rating_weights]
+    else:
+        filenames = [filename for rating, filename in RATING_FILES.items() if _flag(fields, f"use_{rating}")]
+    if not filenames:
+        raise ValueError("No rating files enabled")
+    taglist_files = [get_loaded_taglist_file(filename) for filename in filenames]
+    if any(taglist_file is None for taglist_file in taglist_files):
+        # Load the indexes in the background (a no-op if that already happened) so a retry can succeed
+        start_warmup()
+        raise IndexNotReady(f"Raffle's indexes are not loaded yet ({warmup_status()})")
+    collapse_near_duplicates = _flag(fields, "collapse_near_duplicates")
+    if collapse_near_duplicates and any(get_representatives(f, build=False) is None for f in taglist_files):
+        raise IndexNotReady("The near-duplicate groups are not built yet. Queue a Raffle with "
+                            "collapse_near_duplicates enabled or run dev/find-near-duplicates.py first")
+
+    raffle = Raffle()
+    constraints = ()
+    category_registry = None
+    allowed_category_ids = frozenset()
+    category_constraints = str(fields.get("category_constraints", ""))
+    if category_constraints.strip():
+        category_registry = get_category_registry()
+        constraints = parse_category_constraints(category_constraints, category_registry)
+        excluded_categories = set(raffle.normalize_tags(str(fields.get("exclude_tag_categories", ""))))
+        allowed_category_ids = category_registry.get_category_ids(
+            category for category in ALL_CATEGORIES if category not in excluded_categories
+        )
+        if any(get_category_counts(f, category_registry, build=False) is None for f in taglist_files):
+            raise IndexNotReady("The tag category counts are not built yet. Queue a Raffle with "
+                                "category_constraints first")
+
+    excluded_tags = set(raffle.normalize_tags(str(fields.get("exclude_taglists_containing", ""))))
+    included_tags = set(raffle.normalize_tags(str(fields.get("taglists_must_include", ""))))
+    query = parse_tag_query(str(fields.get("taglist_query", "")))
+    pools, pools_key = raffle._get_pools(filenames, included_tags, excluded_tags, query, collapse_near_duplicates,
+                                 category_constraints=constraints, category_registry=category_registry,
+                                 allowed_category_ids=allowed_category_ids)
+
+    pool_size = sum(len(line_ids) for _, line_ids in pools)
+    result = {
+        "pool_size": pool_size,
+        "files": {taglist_file.filename: len(line_ids) for taglist_file, line_ids in pools},
+        "sample": None,
+    }
+    if pool_size:
+        # Picked the way the node picks it, so the sample is the taglist queueing the same fields would use
+        selection_mode = fields.get("selection_mode", SELECTION_MODES[0])
+        if selection_mode not in SELECTION_MODES:
+            raise ValueError(f"Unknown selection_mode: {selection_mode}")
+        score_weighting = fields.get("score_weighting", SCORE_WEIGHTINGS[0])
+        if score_weighting not in SCORE_WEIGHTINGS:
+            raise ValueError(f"Unknown score_weighting: {score_weighting}")
+        score_temperature = float(fields.get("score_temperature", 1.0))
+        if not 0.05 <= score_temperature <= 100.0:
+            # The node's widget range, 0 would divide by zero
+            raise ValueError(f"score_temperature must be between 0.05 and 100, got {score_temperature}")
+        seed = int(fields.get("seed", 0)) % 0x10000000000000000
+        pool_weights = None
+        rating_prefix_sums = None
+        if rating_weights is not None:
+            pool_weights = raffle._pool_weights(pools, rating_weights)
+            rating_prefix_sums = build_prefix_sums(pool_weights)
+        if score_weighting != "uniform":
+            alias_table = raffle._get_alias_table(pools, pools_key, score_weighting, score_temperature, pool_weights)
+            taglist_file, line_id = raffle._taglist_at(pools, alias_draw(alias_table, seed))
+        else:
+            taglist_file, line_id = raffle._select_taglist(pools, pool_size, seed, selection_mode, rating_prefix_sums)
+        result["sample"] = ', '.join(tokenize_tags(taglist_file.get_line(line_id)))
+    return result
+
+
+async def pool_size_handler(request):
+    """POST a JSON object of filter fields, get back the pool sizes (see compute_pool_size)"""
+    from aiohttp import web
+
+    try:
+        fields = await request.json()
+    except ValueError:
+        return web.json_response({"error": "Expected a JSON object"}, status=400)
+    if not isinstance(fields, dict):
+        return web.json_response({"error": "Expected a JSON object"}, status=400)
+
+    start = time.perf_counter()
+    try:
+        # Filtering runs on a worker thread so the server's event loop stays responsive
+        result = await asyncio.get_running_loop().run_in_executor(None, compute_pool_size, fields)
+    except IndexNotReady as e:
+        return web.json_response({"error": str(e)}, status=503)
+    except (ValueError, TypeError) as e:
+        return web.json_response({"error": str(e)}, status=400)
+
+    result["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return web.json_response(result)
+
+
+def register_routes():
+    """
+    Add the pool size route to ComfyUI's server. Does nothing outside ComfyUI (e.g. in the benchmarks).
+    ComfyUI has already imported its server when it loads custom nodes, so only a server that is
+    already running is used: importing it here would pull in its heavy dependencies.
+    """
+    server = sys.modules.get("server")
+    # Another module named server has no PromptServer
+    prompt_server = getattr(getattr(server, "PromptServer", None), "instance", None)
+    if prompt_server is None:
+        return
+    prompt_server.routes.post(POOL_SIZE_ROUTE)(pool_size_handler)
@@ -1,9 +1,5 @@
 import folder_paths
 import os
-import torch
-import numpy as np
-from PIL import Image, ImageDraw, ImageFont
-import server # Required for preview generation
 import threading
 import shutil # For potential file operations
 from datetime import datetime # For timestamps
@@ -13,8 +9,13 @@ from datetime import datetime # For timestamps
 EXTENSION_PATH = os.path.normpath(os.path.dirname(__file__))
 DEFAULT_HISTORY_FOLDER = os.path.join(EXTENSION_PATH, "history_folder")
 
+# Heavy dependencies (numpy, PIL, server) are imported inside the functions that use them,
+# so loading the extension stays cheap for workers that only use the text nodes.
+
 # Tensor to PIL
 def tensor2pil(image):
+    import numpy as np
+    from PIL import Image
     if image.dim() > 3:
         image = image[0]
     return Image.fromarray(np.clip(255. * image.cpu().numpy().squeeze(), 0, 255).astype(np.uint8))
@@ -24,6 +25,7 @@ def tensor2pil(image):
 # If an error occurs during copy, the image is simply skipped in the preview.
 def create_placeholder(size=(128, 128), text="?"):
     """Creates a simple placeholder PIL image."""
+    from PIL import Image, ImageDraw, ImageFont
     img = Image.new('RGB', size, color = (40, 40, 40))
     d = ImageDraw.Draw(img)
     font = ImageFont.load_default() # Keep it simple for placeholders
@@ -68,6 +70,8 @@ class PreviewHistory:
     # --- Main Execution ---
 
     def execute(self, image, history_size):
+        from PIL import Image
+        import server # Required for preview generation
 
         history_folder = DEFAULT_HISTORY_FOLDER
 
@@ -1,6 +1,20 @@
 import os
-import folder_paths
+import re
+import math
 import random
+import hashlib
+from array import array
+
+from .taglist_index import get_taglist_file, get_taglist_files, PoolCache, RATING_FILES
+from .index_warmup import wait_for_warmup, warmup_status
+from .stage_timings import StageTimings, NO_TIMINGS
+from .tag_tokenizer import tokenize_tags, normalize_tags_cached
+from .weighted_sampling import (SCORE_WEIGHTINGS, score_weight, build_alias_table, alias_draw, alias_table_size,
+                                build_prefix_sums, prefix_sum_draw)
+from .near_duplicates import collapse_pool_duplicates
+from .category_counts import parse_category_constraints, filter_by_category_constraints
+from .tag_query import parse_tag_query, query_taglists
+from .category_registry import ALL_CATEGORIES, get_category_registry
 
 # Default values for Raffle node
 DEFAULT_FILTER_OUT_TAGS = """monochrome, greyscale,
@@ -22,57 +36,63 @@ DEFAULT_EXCLUDE_CATEGORIES = "artist, character_name, copyright, meta, clothes_a
 
 DEFAULT_TAGLISTS_MUST_INCLUDE = "1girl"
 
+# How the seed picks a taglist from the pool
+SELECTION_MODES = ["shuffle (legacy)", "permutation"]
+
+# One entry of rating_weights, e.g. 'sensitive: 70', 'explicit=0.3' or 'general 25%'
+_RATING_WEIGHT_PATTERN = re.compile(r'([a-z]+)\s*[:=]?\s*(\d+(?:\.\d*)?|\.\d+)\s*%?\Z', re.IGNORECASE)
+
 # Critical categories that should be excluded to maintain workflow
 WARNING_ABOUT_NEW_CATEGORIES = {'artist', 'character_name', 'copyright', 'meta'}
 
-# Global list of all available categories - used by both Raffle and TagCategoryStrength
-ALL_CATEGORIES = [
-    'abstract_symbols',
-    'actions',
-    'artstyle_technique',
-    'artist',
-    'background_objects',
-    'bodily_fluids',
-    'camera_angle_perspective',
-    'camera_focus_subject',
-    'camera_framing_composition',
-    'character_count',
-    'character_name',
-    'clothes_and_accessories',
-    'color_scheme',
-    'content_censorship_methods',
-    'copyright',
-    'expressions_and_mental_state',
-    'female_intimate_anatomy',
-    'female_physical_descriptors',
-    'format_and_presentation',
-    'gaze_direction_and_eye_contact',
-    'general_clothing_exposure',
-    'generic_clothing_interactions',
-    'holding_large_items',
-    'holding_small_items',
-    'intentional_design_exposure',
-    'lighting_and_vfx',
-    'male_intimate_anatomy',
-    'male_physical_descriptors',
-    'meta',
-    'metadata_and_attribution',
-    'named_garment_exposure',
-    'nudity_and_absence_of_clothing',
-    'one_handed_character_items',
-    'physical_locations',
-    'poses',
-    'publicly_visible_anatomy',
-    'relationships',
-    'sex_acts',
-    'sfw_clothed_anatomy',
-    'special_backgrounds',
-    'specific_garment_interactions',
-    'speech_and_text',
-    'standard_physical_descriptors',
-    'thematic_settings',
-    'two_handed_character_items'
-]
+def keyed_permutation(index, size, key, rounds=4):
+    """
+    Map index in [0, size) to a position in [0, size) through a keyed bijection.
+    A small Feistel network over the smallest even-bit domain covering size is combined
+    with cycle-walking, so every index gets a distinct position without building the permutation.
+    """
+    half_bits = max(1, ((size - 1).bit_length() + 1) // 2)
+    mask = (1 << half_bits) - 1
+    round_keys = [
+        hashlib.blake2b(f"raffle:{key}:{round_number}".encode('utf-8'), digest_size=16).digest()
+        for round_number in range(rounds)
+    ]
+
+    value = index
+    while True:
+        left, right = value >> half_bits, value & mask
+        for round_key in round_keys:
+            digest = hashlib.blake2b(right.to_bytes(8, 'little'), key=round_key, digest_size=8).digest()
+            left, right = right, left ^ (int.from_bytes(digest, 'little') & mask)
+        value = (left << half_bits) | right
+        # Values outside the pool are walked again until they land inside it
+        if value < size:
+            return value
+
+
+def parse_rating_weights(rating_weights):
+    """
+    Parse rating_weights like 'sensitive: 70, explicit: 30' into {rating: weight}, in RATING_FILES order.
+    Weights are relative and ratings that aren't listed get none. None for an empty string, then the use_* toggles apply.
+    """
+    if not rating_weights.strip():
+        return None
+    weights = {}
+    for entry in re.split(r'[,\n]', rating_weights):
+        entry = entry.strip()
+        if not entry:
+            continue
+        match = _RATING_WEIGHT_PATTERN.match(entry)
+        if match is None:
+            raise ValueError(f"Invalid rating weight '{entry}', expected a rating and a weight like 'sensitive: 70'")
+        rating = match.group(1).lower()
+        if rating not in RATING_FILES:
+            raise ValueError(f"Unknown rating '{rating}' in rating_weights. Valid ratings: {', '.join(RATING_FILES)}")
+        weights[rating] = float(match.group(2))
+    if not any(weights.values()):
+        raise ValueError("rating_weights needs at least one rating with a weight above 0")
+    return {rating: weights[rating] for rating in RATING_FILES if weights.get(rating)}
+
 
 class Raffle:
     # Class variable to track if the critical categories warning has been shown
@@ -102,7 +122,7 @@ class Raffle:
                 "filter_out_tags": ("STRING", {
                     "multiline": True,
                     "default": DEFAULT_FILTER_OUT_TAGS,
-                    "tooltip": "<filter_out_tags> Additional tags to filter out from the final output. Use this to exclude more tags without needing to modify your main negative prompt."
+                    "tooltip": "<filter_out_tags> Additional tags to filter out from the final output. Use this to exclude more tags without needing to modify your main negative prompt. '*' is a wildcard ('*_condom*') and a regular expression goes between slashes ('/.*pubic_hair.*/')."
                 }),
                 "exclude_taglists_containing": ("STRING", {
                     "multiline": True,
@@ -120,7 +140,60 @@ class Raffle:
                     "multiline": True,
                     "forceInput": True,
                     "default": "",
-                    "tooltip": "<negative_prompt> Removes specific tags from the final output without affecting taglist selection. Tags listed here will be filtered out after a taglist is chosen, making this safer to use than 'exclude_taglists_containing'."
+                    "tooltip": "<negative_prompt> Removes specific tags from the final output without affecting taglist selection. Tags listed here will be filtered out after a taglist is chosen, making this safer to use than 'exclude_taglists_containing'. Supports the same '*' and '/regex/' patterns as filter_out_tags."
+                }),
+                "taglist_query": ("STRING", {
+                    "multiline": True,
+                    "default": "",
+                    "tooltip": "<taglist_query> Only select taglists matching this query, on top of the include/exclude lists. Combine tags with AND, OR, NOT and parentheses, and use * as a wildcard, e.g. '1girl AND (beach OR pool) AND NOT *_tail'. Commas work like AND. Tags must use underscores instead of spaces."
+                }),
+                "rating_weights": ("STRING", {
+                    "multiline": False,
+                    "default": "",
+                    "tooltip": "<rating_weights> Mix the ratings by weight instead of the use_* toggles, e.g. 'sensitive: 70, explicit: 30'. The seed first picks a rating by weight, then a taglist of that rating's filtered pool, so the mix doesn't depend on how many taglists each rating has left. Leave empty to use the toggles."
+                }),
+                "selection_mode": (SELECTION_MODES, {
+                    "default": SELECTION_MODES[0],
+                    "tooltip": "<selection_mode> 'shuffle (legacy)' reproduces the outputs of earlier versions. 'permutation' is faster on large pools and guarantees that N consecutive seeds pick N different taglists."
+                }),
+                "score_weighting": (SCORE_WEIGHTINGS, {
+                    "default": SCORE_WEIGHTINGS[0],
+                    "tooltip": "<score_weighting> 'uniform' gives every taglist in the pool the same chance. The other modes favour taglists of higher scoring danbooru posts: 'linear' in proportion to the score, 'log' more gently, 'temperature' by score^(1/score_temperature). When weighting is used, selection_mode is ignored."
+                }),
+                "score_temperature": ("FLOAT", {
+                    "default": 1.0,
+                    "min": 0.05,
+                    "max": 100.0,
+                    "step": 0.05,
+                    "tooltip": "<score_temperature> Only used by the 'temperature' score_weighting. 1.0 is the same as 'linear', higher values flatten towards uniform, lower values favour the top scores even more."
+                }),
+                "category_constraints": ("STRING", {
+                    "multiline": True,
+                    "default": "",
+                    "tooltip": "<category_constraints> Only select taglists with enough (or few enough) tags of some categories, e.g. 'poses >= 3, surviving >= 8'. 'surviving' counts the tags left after exclude_tag_categories, which avoids picking taglists that end up nearly empty. Operators: >=, <=, =, !=, >, <."
+                }),
+                "token_budget": ("INT", {
+                    "default": 0,
+                    "min": 0,
+                    "max": 1000,
+                    "tooltip": "<token_budget> Maximum CLIP tokens of the Raffled output, e.g. 75 for one CLIP chunk. Tags are dropped, lowest category priority first, until the output fits. 0 disables trimming."
+                }),
+                "token_budget_priority": ("STRING", {
+                    "multiline": True,
+                    "default": "",
+                    "tooltip": "<token_budget_priority> Categories whose tags are kept first when trimming to token_budget, highest priority first, separated by commas. Tags of unlisted categories are kept after them, in categorized_tags.txt order."
+                }),
+                "collapse_near_duplicates": ("BOOLEAN", {
+                    "default": False,
+                    "tooltip": "<collapse_near_duplicates> Keep only one taglist (the highest scoring) of every group of near-identical taglists in the pool, so long seed runs don't keep landing on variants of the same post. The groups are found once per list file and cached."
+                }),
+                "debug_timings": ("BOOLEAN", {
+                    "default": False,
+                    "tooltip": "<debug_timings> Add a per-stage timing breakdown (index loading, filtering, selection, post-filtering) to the 'Debug info' output"
+                }),
+                "debug_filter_impact": ("BOOLEAN", {
+                    "default": False,
+                    "tooltip": "<debug_filter_impact> Add to the 'Debug info' output how many taglists each taglists_must_include and exclude_taglists_containing tag removes on its own, and the pool size without it. Useful to find the tag that makes a pool small."
                 })
             }
         }
@@ -136,48 +209,171 @@ class Raffle:
     OUTPUT_NODE = True
     FUNCTION = "process_tags"
 
-    # Add class variable to cache tag lists
-    _tag_cache = {}
-    
-    def _load_taglist(self, filename, taglists_must_include_tags=None, exclude_tags=None, seed=0):
-        """Load a line from a file, finding taglists that match required tags"""
-        extension_path = os.path.normpath(os.path.dirname(__file__))
-        filepath = os.path.join(extension_path, "lists", filename)
+    # Filtered pools shared by all Raffle nodes, so sweeping seeds with the same filters skips the filtering
+    _pool_cache = PoolCache()
+    # Alias tables for score-weighted sampling, built once per pool and weighting
+    _alias_cache = PoolCache(size_of=alias_table_size, name="Alias table cache")
+
+    def _load_taglist(self, filename, taglists_must_include_tags=None, exclude_tags=None, seed=0, query=None):
+        """
+        Find the taglists in a file that match the required tags (and the parsed taglist_query, if any).
+        Returns the file's index and the matching line ids, so the pool stays a compact integer array.
+        """
+        taglist_file = get_taglist_file(filename)
+        if query is not None:
+            return taglist_file, query_taglists(taglist_file, query, taglists_must_include_tags, exclude_tags)
+        return taglist_file, taglist_file.find_taglists(taglists_must_include_tags, exclude_tags)
+
+    def _get_pools(self, filenames, taglists_must_include_tags, exclude_tags, query=None,
+                   collapse_near_duplicates=False, timings=NO_TIMINGS, category_constraints=(),
+                   category_registry=None, allowed_category_ids=frozenset(), filter_impacts=None):
+        """
+        Return the pools, a list of (taglist file, matching line ids) for each enabled file, and their cache key.
+        A cached pool is reused when the filters and files are unchanged.
+        Parsed category_constraints are checked against the category_registry, with 'surviving' counting
+        the tags of the allowed_category_ids.
+        If filter_impacts is a list, the include/exclude filtering also appends each file's filter impact to it.
+        """
+        # Missing indexes are built in parallel, one file per worker process
+        taglist_files = get_taglist_files(filenames)
+        timings.mark("load indexes", ", ".join(f"{f.filename} {len(f)}" for f in taglist_files))
+        cache_key = (
+            PoolCache.make_key(taglist_files, taglists_must_include_tags, exclude_tags),
+            str(query) if query is not None else None,
+            collapse_near_duplicates,
+            (category_constraints, frozenset(allowed_category_ids), category_registry.mtime_ns)
+            if category_constraints else None,
+        )
         
-        try:
-            valid_taglists = []
-            
-            # Pre-compute sets for faster lookups - no need to normalize these
-            exclude_tags_set = set(exclude_tags) if exclude_tags else None
-            taglists_must_include_set = set(taglists_must_include_tags) if taglists_must_include_tags else None
-            
-            # First pass: find taglists that match our criteria
-            with open(filepath, 'r', encoding='utf-8') as f:
-                for taglist_num, taglist in enumerate(f):
-                    taglist = taglist.strip()
-                    if not taglist:
-                        continue
-                    
-                    # Split on comma since file is already normalized
-                    taglist_tags = frozenset(tag.strip() for tag in taglist.split(','))
-                    
-                    # Check for excluded tags first (using set intersection for speed)
-                    if exclude_tags_set and not taglist_tags.isdisjoint(exclude_tags_set):
-                        continue
-                    
-                    # If we have required tags, check if they're all in this taglist
-                    if taglists_must_include_set:
-                        if taglists_must_include_set.issubset(taglist_tags):
-                            valid_taglists.append((filename, taglist))
-                    else:
-                        valid_taglists.append((filename, taglist))
-            
-            return valid_taglists
-                    
-        except Exception as e:
-            raise
+        pools = Raffle._pool_cache.get(cache_key)
+        if pools is not None:
+            timings.mark("pool cache lookup", "hit")
+            return pools, cache_key
+        timings.mark("pool cache lookup", "miss")
+
+        pools = []
+        for filename in filenames:
+            if filter_impacts is not None and query is None:
+                # The impact of every filter tag comes out of the same pass that filters the file
+                taglist_file = get_taglist_file(filename)
+                line_ids, include_impact, exclude_impact = taglist_file.filter_impact(
+                    taglists_must_include_tags, exclude_tags
+                )
+                filter_impacts.append((len(line_ids), include_impact, exclude_impact))
+                pools.append((taglist_file, line_ids))
+            else:
+                pools.append(self._load_taglist(filename, taglists_must_include_tags, exclude_tags, query=query))
+            timings.mark(f"filter {filename}", f"pool {len(pools[-1][1])}")
+            if category_constraints:
+                taglist_file, line_ids = pools[-1]
+                pools[-1] = (taglist_file, filter_by_category_constraints(
+                    taglist_file, line_ids, category_constraints, category_registry, allowed_category_ids
+                ))
+                timings.mark(f"category constraints {filename}", f"pool {len(pools[-1][1])}")
+            if collapse_near_duplicates:
+                taglist_file, line_ids = pools[-1]
+                pools[-1] = (taglist_file, collapse_pool_duplicates(taglist_file, line_ids))
+                timings.mark(f"collapse near-duplicates {filename}", f"pool {len(pools[-1][1])}")
+        Raffle._pool_cache.put(cache_key, pools)
+        return pools, cache_key
+
+    def _get_alias_table(self, pools, pools_key, score_weighting, score_temperature, pool_weights=None):
+        """
+        Alias table over the combined pool, weighting each taglist by its score.
+        With pool_weights (rating weights), each pool's taglists share its weight instead of their own total.
+        """
+        cache_key = (pools_key, score_weighting, score_temperature if score_weighting == "temperature" else None,
+                     tuple(pool_weights) if pool_weights is not None else None)
+        alias_table = Raffle._alias_cache.get(cache_key)
+        if alias_table is None:
+            weights = []
+            for pool_index, (taglist_file, line_ids) in enumerate(pools):
+                file_weights = [
+                    score_weight(taglist_file.scores[line_id], score_weighting, score_temperature)
+                    for line_id in line_ids
+                ]
+                if pool_weights is not None and file_weights:
+                    scale = pool_weights[pool_index] / math.fsum(file_weights)
+                    file_weights = [weight * scale for weight in file_weights]
+                weights.extend(file_weights)
+            alias_table = build_alias_table(weights)
+            Raffle._alias_cache.put(cache_key, alias_table)
+        return alias_table
+
+    def _filter_impact(self, pools, taglists_must_include_tags, exclude_tags, file_impacts):
+        """
+        Debug info report of how much each include/exclude tag shrinks the pool, summed over the enabled files.
+        file_impacts are the per-file results _get_pools collected while filtering, if it did.
+        """
+        if len(file_impacts) != len(pools):
+            # The pools came from the cache or a taglist_query, so nothing was collected
+            file_impacts = []
+            for taglist_file, _ in pools:
+                line_ids, file_include_impact, file_exclude_impact = taglist_file.filter_impact(
+                    taglists_must_include_tags, exclude_tags
+                )
+                file_impacts.append((len(line_ids), file_include_impact, file_exclude_impact))
+
+        pool_size = 0
+        include_impact = dict.fromkeys(taglists_must_include_tags, 0)
+        exclude_impact = dict.fromkeys(exclude_tags, 0)
+        for file_pool_size, file_include_impact, file_exclude_impact in file_impacts:
+            pool_size += file_pool_size
+            for tag, size in file_include_impact.items():
+                include_impact[tag] += size
+            for tag, removed in file_exclude_impact.items():
+                exclude_impact[tag] += removed
+
+        report = [f"-- Filter impact --\nPool size from the include/exclude lists alone: {pool_size}"]
+        if include_impact:
+            report.append("taglists_must_include (pool size without the tag):")
+            for tag, size in sorted(include_impact.items(), key=lambda item: (-item[1], item[0])):
+                report.append(f"  {tag}: {size} (+{size - pool_size})")
+        if exclude_impact:
+            report.append("exclude_taglists_containing (taglists only this tag removes):")
+            for tag, removed in sorted(exclude_impact.items(), key=lambda item: (-item[1], item[0])):
+                report.append(f"  {tag}: {removed} (pool size without it {pool_size + removed})")
+        return "\n".join(report)
+
+    def _select_position(self, seed, pool_size, selection_mode):
+        """Turn the seed into a position inside the combined pool"""
+        if selection_mode == "permutation":
+            # Each run of pool_size consecutive seeds is one permutation of the pool, keyed by which run it is
+            return keyed_permutation(seed % pool_size, pool_size, seed // pool_size)
         
-        return []
+        # Legacy: use seed to shuffle all positions and take the one at seed % pool_size.
+        # Shuffling positions instead of the taglists themselves gives the same permutation as before.
+        rng = random.Random(seed)
+        shuffled_positions = array('I', range(pool_size))
+        rng.shuffle(shuffled_positions)
+        return shuffled_positions[seed % pool_size]
+
+    @staticmethod
+    def _pool_weights(pools, rating_weights):
+        """The rating weight of each pool, 0 for an empty pool so its share goes to the other ratings"""
+        return [
+            rating_weights[rating] if line_ids else 0.0
+            for rating, (_, line_ids) in zip(rating_weights, pools)
+        ]
+
+    def _select_taglist(self, pools, pool_size, seed, selection_mode, rating_prefix_sums=None):
+        """
+        (taglist file, line id) the seed picks. With the prefix sums of rating weights, the seed first picks
+        a rating by weight and then a position inside that rating's pool, so the pools are never combined.
+        """
+        if rating_prefix_sums is None:
+            return self._taglist_at(pools, self._select_position(seed, pool_size, selection_mode))
+        taglist_file, line_ids = pools[prefix_sum_draw(rating_prefix_sums, seed, "rating")]
+        return taglist_file, line_ids[self._select_position(seed, len(line_ids), selection_mode)]
+
+    @staticmethod
+    def _taglist_at(pools, position):
+        """(taglist file, line id) at a position of the combined pool"""
+        for taglist_file, line_ids in pools:
+            if position < len(line_ids):
+                break
+            position -= len(line_ids)
+        return taglist_file, line_ids[position]
 
     def normalize_tags(self, tag_string):
         """
@@ -196,33 +392,19 @@ class Raffle:
             "red hair,,blue_hair"     -> ["red_hair", "blue_hair"]
             "red   hair,blue  hair"   -> ["red_hair", "blue_hair"]
         """
-        # Replace newlines with commas
-        tag_string = tag_string.replace('\r\n', '\n')  # Normalize line endings
-        tag_string = tag_string.replace('\n', ',')
-        
-        # Remove multiple consecutive spaces
-        while '  ' in tag_string:
-            tag_string = tag_string.replace('  ', ' ')
-            
-        # Remove multiple consecutive commas
-        while ',,' in tag_string:
-            tag_string = tag_string.replace(',,', ',')
-        
-        # Then split on commas (handling both ", " and "," cases)
-        tags = tag_string.replace(', ', ',').split(',')
-        
-        # Then normalize each tag
-        return [
-            tag.strip().replace(' ', '_')
-            for tag in tags
-            if tag.strip()
-        ]
+        # Unchanged widget strings are answered from a memo of earlier results
+        return list(normalize_tags_cached(tag_string))
 
-    def process_tags(self, exclude_taglists_containing, taglists_must_include, seed,
-                    filter_out_tags="", use_general=True, use_questionable=False, 
-                    use_sensitive=False, use_explicit=False, exclude_tag_categories="",
-                    negative_prompt=""):
-        
+    def _prepare_raffle(self, exclude_taglists_containing, taglists_must_include, filter_out_tags,
+                        use_general, use_questionable, use_sensitive, use_explicit,
+                        exclude_tag_categories, negative_prompt, score_weighting="uniform",
+                        score_temperature=1.0, collapse_near_duplicates=False, taglist_query="",
+                        timings=NO_TIMINGS, category_constraints="", token_budget=0, token_budget_priority="",
+                        debug_filter_impact=False, rating_weights=""):
+        """
+        Everything that doesn't depend on the seed: validate the settings, build the filtered pool
+        and the lookups used to filter a selected taglist. Shared by Raffle and RaffleBatch.
+        """
         # Add directory existence check
         extension_path = os.path.normpath(os.path.dirname(__file__))
         lists_path = os.path.join(extension_path, "lists")
@@ -230,11 +412,9 @@ class Raffle:
         if not os.path.exists(lists_path):
             raise ValueError(f"Lists directory not found at {lists_path}")
 
-        # Check for categorized tags file
-        categorized_tags_file_path = os.path.join(lists_path, "categorized_tags.txt")
-        
-        if not os.path.exists(categorized_tags_file_path):
-            raise ValueError(f"Categorized tags file not found at {categorized_tags_file_path}")
+        # Let a running background warm-up finish loading the indexes instead of building them twice
+        wait_for_warmup()
+        timings.mark("wait for warm-up")
 
         # Use the global categories list
         all_categories = ALL_CATEGORIES
@@ -267,97 +447,212 @@ class Raffle:
             )
             raise ValueError(warning_msg)
         
-        # Set up categories dictionary - enable all categories except excluded ones
-        categories = {category: (category not in excluded_categories) for category in all_categories}
-        
-        # Create the categories debug output
-        categories_debug = "-- List of Categories --\n" + "\n".join(all_categories)
-        
-        # Load categorized tags with error handling
-        allowed_tags = []  # Changed from set to list to preserve order
-        
-        try:
-            with open(categorized_tags_file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-                
-                for line in content.splitlines():
-                    line = line.strip()
-                    if not line:
-                        continue
-                    
-                    parts = line.split('] ', 1)
-                    if len(parts) != 2:
-                        continue
-                        
-                    category = parts[0][1:]  # Remove the leading [
-                    tag = parts[1]
-                    
-                    if categories.get(category):
-                        allowed_tags.append(tag)  # Add the complete tag
-                    
-        except Exception as e:
-            raise
+        timings.restart()
+        # Shared tag -> (category, rank) lookup, only re-parsed when categorized_tags.txt changes
+        category_registry = get_category_registry()
+        # Enable all categories except excluded ones
+        allowed_category_ids = category_registry.get_category_ids(
+            category for category in all_categories if category not in excluded_categories_set
+        )
+        timings.mark("category registry", f"{len(category_registry.tag_info)} tags")
+
+        # Category id -> position in token_budget_priority
+        category_priority = {}
+        if token_budget:
+            priority_categories = self.normalize_tags(token_budget_priority)
+            invalid_categories = [c for c in priority_categories if c not in all_categories]
+            if invalid_categories:
+                raise ValueError(f"Error: Invalid category names in token_budget_priority: {', '.join(invalid_categories)}. "
+                                 f"Please check the Debug info output for a complete list of valid categories.")
+            for category in priority_categories:
+                category_priority.setdefault(category_registry.category_ids[category], len(category_priority))
 
         # Parse exclude and include lists
         excluded_tags = set(self.normalize_tags(exclude_taglists_containing))
         included_tags = set(self.normalize_tags(taglists_must_include))
+        query = parse_tag_query(taglist_query)
+        constraints = parse_category_constraints(category_constraints, category_registry)
+        parsed_rating_weights = parse_rating_weights(rating_weights)
+        timings.mark("parse include/exclude tags")
 
-        # Collect all valid taglists from all enabled files
-        all_valid_taglists = []
-        
-        if use_general:
-            all_valid_taglists.extend(self._load_taglist("taglists-general.txt", included_tags, excluded_tags, seed))
-        if use_questionable:
-            all_valid_taglists.extend(self._load_taglist("taglists-questionable.txt", included_tags, excluded_tags, seed))
-        if use_sensitive:
-            all_valid_taglists.extend(self._load_taglist("taglists-sensitive.txt", included_tags, excluded_tags, seed))
-        if use_explicit:
-            all_valid_taglists.extend(self._load_taglist("taglists-explicit.txt", included_tags, excluded_tags, seed))
-
-        if not all_valid_taglists:
+        # Collect the matching line ids from all enabled files (the weighted ratings replace the toggles)
+        if parsed_rating_weights is not None:
+            enabled_files = [RATING_FILES[rating] for rating in parsed_rating_weights]
+        else:
+            enabled_files = [RATING_FILES[rating] for enabled, rating in (
+                (use_general, "general"),
+                (use_questionable, "questionable"),
+                (use_sensitive, "sensitive"),
+                (use_explicit, "explicit"),
+            ) if enabled]
+        file_impacts = []
+        pools, pools_key = self._get_pools(
+            enabled_files, included_tags, excluded_tags, query, collapse_near_duplicates, timings,
+            constraints, category_registry, allowed_category_ids,
+            filter_impacts=file_impacts if debug_filter_impact else None
+        )
+
+        pool_size = sum(len(line_ids) for _, line_ids in pools)
+        filter_impact = None
+        if debug_filter_impact:
+            # Worked out before the empty pool check, which is when it's needed most
+            timings.restart()
+            filter_impact = self._filter_impact(pools, included_tags, excluded_tags, file_impacts)
+            timings.mark("filter impact")
+        if not pool_size:
+            if filter_impact is not None:
+                raise ValueError(f"No tags available - no matching taglists found\n\n{filter_impact}")
             raise ValueError("No tags available - no matching taglists found")
 
-        # Use seed to shuffle and select from all valid taglists
-        rng = random.Random(seed)
-        rng.shuffle(all_valid_taglists)
-        
+        pool_weights = None
+        rating_prefix_sums = None
+        if parsed_rating_weights is not None:
+            pool_weights = self._pool_weights(pools, parsed_rating_weights)
+            rating_prefix_sums = build_prefix_sums(pool_weights)
+
+        alias_table = None
+        if score_weighting != "uniform":
+            timings.restart()
+            alias_table = self._get_alias_table(pools, pools_key, score_weighting, score_temperature, pool_weights)
+            timings.mark("score weighting", score_weighting)
+
+        # Tags removed from the output after selection: the excluded tags, the negative prompt and filter_out_tags
+        # Wildcard and regex patterns are expanded against the categorized tags (cached per filter text)
+        negative_tags = category_registry.expand_tag_patterns(self.normalize_tags(negative_prompt))
+        filter_out_tags_set = category_registry.expand_tag_patterns(self.normalize_tags(filter_out_tags))
+        removed_tags = excluded_tags | negative_tags | filter_out_tags_set
+        timings.mark("parse output filters")
+
+        return {
+            "pools": pools,
+            "pool_size": pool_size,
+            "query": query,
+            "category_constraints": category_constraints.strip() if constraints else None,
+            "alias_table": alias_table,
+            "score_weighting": score_weighting,
+            "rating_weights": parsed_rating_weights,
+            "rating_prefix_sums": rating_prefix_sums,
+            "category_registry": category_registry,
+            "allowed_category_ids": allowed_category_ids,
+            "removed_tags": removed_tags,
+            "token_budget": token_budget,
+            "filter_impact": filter_impact,
+            "category_priority": category_priority,
+            # Kept apart only to count what each filter removes when timings are enabled
+            "post_filters": (
+                ("exclude_taglists_containing", excluded_tags),
+                ("negative_prompt", negative_tags),
+                ("filter_out_tags", filter_out_tags_set),
+            ),
+            "timings": timings,
+        }
+
+    def _raffle_taglist(self, raffle_setup, seed, selection_mode):
+        """Select one taglist for a seed and filter it. Returns (raffled output, unfiltered taglist)"""
+        timings = raffle_setup["timings"]
+        timings.restart()
+
         # Take just 1 taglist based on seed
-        selected_index = seed % len(all_valid_taglists)
-        selected_taglist = all_valid_taglists[selected_index]
+        if raffle_setup["alias_table"] is not None:
+            taglist_file, line_id = self._taglist_at(raffle_setup["pools"], alias_draw(raffle_setup["alias_table"], seed))
+        else:
+            taglist_file, line_id = self._select_taglist(
+                raffle_setup["pools"], raffle_setup["pool_size"], seed, selection_mode, raffle_setup["rating_prefix_sums"]
+            )
         
-        # Extract just the taglist (without filename)
-        _, unfiltered_taglist = selected_taglist
-        # Normalize the unfiltered taglist for consistency in output
-        unfiltered_taglist = ', '.join(self.normalize_tags(unfiltered_taglist))
+        # Only the selected taglist is decoded from its file, normalized for consistency in output
+        # (taglists are tokenized directly, they would only push the widget strings out of the memo)
+        individual_tags = tokenize_tags(taglist_file.get_line(line_id))
+        unfiltered_taglist = ', '.join(individual_tags)
+        timings.mark("selection", f"{selection_mode}, {taglist_file.filename}")
 
-        # Split the taglist into individual tags and normalize them
-        individual_tags = self.normalize_tags(unfiltered_taglist)
+        # Keep tags from enabled categories, ordered as in categorized_tags.txt
+        filtered_tags = raffle_setup["category_registry"].filter_and_order(
+            individual_tags, raffle_setup["allowed_category_ids"]
+        )
 
-        # Filter tags using allowed_tags and maintain order
-        allowed_tags_set = set(allowed_tags)  # For faster lookup
-        filtered_tags = [tag for tag in individual_tags if tag in allowed_tags_set]
-        
-        try:
-            filtered_tags.sort(key=lambda x: allowed_tags.index(x) if x in allowed_tags else len(allowed_tags))
-        except Exception as e:
-            raise
+        # Remove excluded, negative prompt and filter_out_tags tags
+        removed_tags = raffle_setup["removed_tags"]
+        filtered_tags_count = len(filtered_tags)
+        filtered_tags = [tag for tag in filtered_tags if tag not in removed_tags]
+        timings.mark("post-filter")
 
-        # Remove excluded tags
-        filtered_tags = [tag for tag in filtered_tags if tag not in excluded_tags]
-        
-        # Process negative prompt tags
-        negative_tags = set(self.normalize_tags(negative_prompt))
-        filtered_tags = [tag for tag in filtered_tags if tag not in negative_tags]
+        if timings.enabled:
+            # Count what each filter removes, applied in order, outside of the timed stages
+            removed_counts = [("category", filtered_tags_count - len(individual_tags))]
+            remaining_tags = raffle_setup["category_registry"].filter_and_order(
+                individual_tags, raffle_setup["allowed_category_ids"]
+            )
+            for filter_name, filter_tags in raffle_setup["post_filters"]:
+                kept_tags = [tag for tag in remaining_tags if tag not in filter_tags]
+                removed_counts.append((filter_name, len(kept_tags) - len(remaining_tags)))
+                remaining_tags = kept_tags
+            timings.add_counts("post-filter", removed_counts)
+            timings.restart()
+
+        token_budget = raffle_setup["token_budget"]
+        if token_budget:
+            # Uses the token count of every tag precomputed in the category registry
+            tag_count = len(filtered_tags)
+            filtered_tags, used_tokens = raffle_setup["category_registry"].trim_to_token_budget(
+                filtered_tags, token_budget, raffle_setup["category_priority"]
+            )
+            timings.mark("token budget", f"{used_tokens}/{token_budget} tokens, -{tag_count - len(filtered_tags)} tags")
+
+        return ', '.join(filtered_tags), unfiltered_taglist
 
-        # Process negative prompt 2 tags
-        filter_out_tags_set = set(self.normalize_tags(filter_out_tags))
-        filtered_tags = [tag for tag in filtered_tags if tag not in filter_out_tags_set]
+    def _debug_info(self, raffle_setup):
+        """Pool statistics, optional stage timings and the list of categories for the Debug info output"""
+        categories_debug = "-- List of Categories --\n" + "\n".join(ALL_CATEGORIES)
+        debug_info = f"Taglist pool size: {raffle_setup['pool_size']}\n{Raffle._pool_cache.stats()}\n"
+        if raffle_setup["rating_weights"] is not None:
+            pool_weights = self._pool_weights(raffle_setup["pools"], raffle_setup["rating_weights"])
+            total_weight = math.fsum(pool_weights)
+            debug_info += "Rating weights: " + ", ".join(
+                f"{rating} {100 * weight / total_weight:.1f}% of {len(line_ids)}" if weight else f"{rating} skipped (empty pool)"
+                for rating, weight, (_, line_ids) in zip(raffle_setup["rating_weights"], pool_weights, raffle_setup["pools"])
+            ) + "\n"
+        if raffle_setup["query"] is not None:
+            debug_info += f"Taglist query: {raffle_setup['query']}\n"
+        if raffle_setup["category_constraints"] is not None:
+            debug_info += f"Category constraints: {raffle_setup['category_constraints']}\n"
+        if raffle_setup["token_budget"]:
+            token_counts = raffle_setup["category_registry"].token_count_source
+            token_counts = "estimated" if token_counts == "estimate" else "CLIP BPE"
+            debug_info += f"Token budget: {raffle_setup['token_budget']} ({token_counts} token counts)\n"
+        if raffle_setup["alias_table"] is not None:
+            debug_info += f"Score weighting: {raffle_setup['score_weighting']}\n{Raffle._alias_cache.stats()}\n"
+        debug_info += f"{warmup_status()}\n\n"
+        if raffle_setup["filter_impact"] is not None:
+            debug_info += raffle_setup["filter_impact"] + "\n\n"
+        if raffle_setup["timings"].enabled:
+            debug_info += raffle_setup["timings"].report() + "\n\n"
+        return debug_info + categories_debug
+
+    def process_tags(self, exclude_taglists_containing, taglists_must_include, seed,
+                    filter_out_tags="", use_general=True, use_questionable=False, 
+                    use_sensitive=False, use_explicit=False, exclude_tag_categories="",
+                    negative_prompt="", selection_mode=SELECTION_MODES[0], score_weighting=SCORE_WEIGHTINGS[0],
+                    score_temperature=1.0, collapse_near_duplicates=False, taglist_query="", debug_timings=False,
+                    category_constraints="", token_budget=0, token_budget_priority="", debug_filter_impact=False,
+                    rating_weights=""):
+        
+        raffle_setup = self._prepare_raffle(
+            exclude_taglists_containing, taglists_must_include, filter_out_tags,
+            use_general, use_questionable, use_sensitive, use_explicit,
+            exclude_tag_categories, negative_prompt, score_weighting, score_temperature,
+            collapse_near_duplicates, taglist_query,
+            timings=StageTimings() if debug_timings else NO_TIMINGS,
+            category_constraints=category_constraints, token_budget=token_budget,
+            token_budget_priority=token_budget_priority, debug_filter_impact=debug_filter_impact,
+            rating_weights=rating_weights
+        )
+        raffled_output, unfiltered_taglist = self._raffle_taglist(raffle_setup, seed, selection_mode)
 
-        debug_info = f"Taglist pool size: {len(all_valid_taglists)}\n\n{categories_debug}"
         return_values = (
-            ', '.join(filtered_tags),
+            raffled_output,
             unfiltered_taglist,
-            debug_info
+            self._debug_info(raffle_setup)
         )
         
-        return return_values
\ No newline at end of file
+        return return_values
@@ -0,0 +1,78 @@
+from .raffle import Raffle, SELECTION_MODES
+from .stage_timings import StageTimings, NO_TIMINGS
+
+
+class RaffleBatch(Raffle):
+    """Raffle variant that outputs a list of prompts for consecutive seeds from a single filtering pass"""
+
+    @classmethod
+    def INPUT_TYPES(s):
+        input_types = super().INPUT_TYPES()
+
+        required = {
+            "seed": ("INT", {
+                "default": 0,
+                "min": 0,
+                "max": 0xffffffffffffffff,
+                "tooltip": "First seed of the batch. The batch uses seeds seed, seed+1, ... seed+count-1, each picking the same taglist Raffle would pick with that seed and selection_mode"
+            }),
+            "count": ("INT", {
+                "default": 8,
+                "min": 1,
+                "max": 100000,
+                "tooltip": "How many prompts to raffle in one execution"
+            }),
+        }
+        for name, input_type in input_types["required"].items():
+            required.setdefault(name, input_type)
+
+        optional = dict(input_types["optional"])
+        optional["selection_mode"] = (SELECTION_MODES, {
+            "default": "permutation",
+            "tooltip": "<selection_mode> 'permutation' guarantees that a batch never repeats a taglist as long as count is not larger than the pool. 'shuffle (legacy)' reshuffles the whole pool for every prompt and is much slower."
+        })
+
+        return {"required": required, "optional": optional}
+
+    RETURN_TYPES = ("STRING", "STRING", "STRING")
+    RETURN_NAMES = ("Raffled outputs", "Unfiltered", "Debug info")
+    OUTPUT_IS_LIST = (True, True, False)
+    OUTPUT_TOOLTIPS = (
+        "One filtered taglist per seed of the batch, ready for use",
+        "The complete original taglists that were selected, before any filtering was applied",
+        "Information about the selection process, including the size of the available pool of taglists after applying your filters"
+    )
+    FUNCTION = "process_batch"
+
+    def process_batch(self, exclude_taglists_containing, taglists_must_include, seed, count,
+                      filter_out_tags="", use_general=True, use_questionable=False,
+                      use_sensitive=False, use_explicit=False, exclude_tag_categories="",
+                      negative_prompt="", selection_mode="permutation", score_weighting="uniform",
+                      score_temperature=1.0, collapse_near_duplicates=False, taglist_query="",
+                      debug_timings=False, category_constraints="", token_budget=0, token_budget_priority="",
+                      debug_filter_impact=False, rating_weights=""):
+
+        # The pool and all filter lookups are built once for the whole batch
+        raffle_setup = self._prepare_raffle(
+            exclude_taglists_containing, taglists_must_include, filter_out_tags,
+            use_general, use_questionable, use_sensitive, use_explicit,
+            exclude_tag_categories, negative_prompt, score_weighting, score_temperature,
+            collapse_near_duplicates, taglist_query,
+            timings=StageTimings() if debug_timings else NO_TIMINGS,
+            category_constraints=category_constraints, token_budget=token_budget,
+            token_budget_priority=token_budget_priority, debug_filter_impact=debug_filter_impact,
+            rating_weights=rating_weights
+        )
+
+        raffled_outputs = []
+        unfiltered_taglists = []
+        for batch_seed in range(seed, seed + count):
+            # Seeds wrap around like the INT widget does
+            raffled_output, unfiltered_taglist = self._raffle_taglist(
+                raffle_setup, batch_seed % 0x10000000000000000, selection_mode
+            )
+            raffled_outputs.append(raffled_output)
+            unfiltered_taglists.append(unfiltered_taglist)
+
+        debug_info = f"Batch: {count} prompts from seed {seed}\n{self._debug_info(raffle_setup)}"
+        return (raffled_outputs, unfiltered_taglists, debug_info)
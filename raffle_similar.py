@@ -0,0 +1,93 @@
+from array import array
+
+from .raffle import Raffle, SELECTION_MODES
+from .stage_timings import StageTimings, NO_TIMINGS
+from .tag_tokenizer import tokenize_tags
+from .taglist_index import split_taglist
+from .taglist_similarity import find_similar_taglists
+
+
+class RaffleSimilar(Raffle):
+    """Raffle variant that picks among the taglists most similar to a prompt instead of the whole pool"""
+
+    @classmethod
+    def INPUT_TYPES(s):
+        input_types = super().INPUT_TYPES()
+
+        required = {
+            "prompt": ("STRING", {
+                "multiline": True,
+                "default": "",
+                "tooltip": "<prompt> Tags to find similar taglists for, e.g. the 'Unfiltered' output of a previous Raffle. Taglists sharing more of these tags, especially rare ones, are more similar."
+            }),
+            "top_k": ("INT", {
+                "default": 20,
+                "min": 1,
+                "max": 10000,
+                "tooltip": "<top_k> How many of the most similar taglists the seed picks from. 1 always gives the most similar one."
+            }),
+        }
+        for name, input_type in input_types["required"].items():
+            required.setdefault(name, input_type)
+        required["seed"] = ("INT", {
+            "default": 0,
+            "min": 0,
+            "max": 0xffffffffffffffff,
+            "tooltip": "Seed value used to select one of the top_k most similar taglists"
+        })
+
+        # Selection is among the most similar taglists, so score and rating weights don't apply
+        optional = {name: input_type for name, input_type in input_types["optional"].items()
+                    if name not in ("score_weighting", "score_temperature", "rating_weights")}
+
+        return {"required": required, "optional": optional}
+
+    RETURN_NAMES = ("Raffled output", "Unfiltered", "Debug info")
+    OUTPUT_TOOLTIPS = (
+        "The selected similar taglist, filtered according to your settings, ready for use",
+        "The complete original taglist that was selected before any filtering was applied",
+        "The similarity of the top_k taglists and information about the filtered pool they were found in"
+    )
+    FUNCTION = "process_similar"
+
+    def process_similar(self, prompt, top_k, exclude_taglists_containing, taglists_must_include, seed,
+                        filter_out_tags="", use_general=True, use_questionable=False,
+                        use_sensitive=False, use_explicit=False, exclude_tag_categories="",
+                        negative_prompt="", selection_mode=SELECTION_MODES[0], collapse_near_duplicates=False,
+                        taglist_query="", debug_timings=False, category_constraints="", token_budget=0, token_budget_priority="",
+                        debug_filter_impact=False):
+
+        # The pool filters (include/exclude, taglist_query, category_constraints, near-duplicates) define what is searched
+        raffle_setup = self._prepare_raffle(
+            exclude_taglists_containing, taglists_must_include, filter_out_tags,
+            use_general, use_questionable, use_sensitive, use_explicit,
+            exclude_tag_categories, negative_prompt, "uniform", 1.0,
+            collapse_near_duplicates, taglist_query,
+            timings=StageTimings() if debug_timings else NO_TIMINGS,
+            category_constraints=category_constraints, token_budget=token_budget,
+            token_budget_priority=token_budget_priority, debug_filter_impact=debug_filter_impact
+        )
+        timings = raffle_setup["timings"]
+
+        timings.restart()
+        # A pasted taglist may still start with its post_id and score
+        query_tags = split_taglist(', '.join(tokenize_tags(prompt)))[1]
+        if not query_tags:
+            raise ValueError("The prompt has no tags to find similar taglists for")
+        matches = find_similar_taglists(raffle_setup["pools"], query_tags, top_k)
+        if not matches:
+            raise ValueError("No taglist in the pool shares a tag with the prompt")
+        timings.mark("similarity search", f"top {len(matches)} of {raffle_setup['pool_size']}")
+
+        # The seed picks among the matches the same way Raffle picks from a pool, most similar first
+        similar_setup = dict(
+            raffle_setup,
+            pools=[(taglist_file, array('I', [line_id])) for _, taglist_file, line_id in matches],
+            pool_size=len(matches),
+        )
+        raffled_output, unfiltered_taglist = self._raffle_taglist(similar_setup, seed, selection_mode)
+
+        similarities = ", ".join(f"{similarity:.3f}" for similarity, _, _ in matches)
+        debug_info = (f"Similar taglists: {len(matches)} (similarity {similarities})\n"
+                      f"{self._debug_info(raffle_setup)}")
+        return (raffled_output, unfiltered_taglist, debug_info)
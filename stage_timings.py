@@ -0,0 +1,72 @@
+import time
+
+
+class StageTimings:
+    """
+    Collects high-resolution timings and counts for the stages of a Raffle run, for the Debug info output.
+    Each mark() records the time since the previous mark under a stage name; repeated stages are summed.
+    """
+    enabled = True
+
+    def __init__(self):
+        self.stages = {}  # stage -> [seconds, calls, detail]
+        self._counts = {}  # stage -> {name: count}, see add_counts
+        self._start = self._last = time.perf_counter()
+
+    def restart(self):
+        """Start timing the next stage from now, leaving out whatever happened since the last mark"""
+        self._last = time.perf_counter()
+
+    def _entry(self, stage):
+        entry = self.stages.get(stage)
+        if entry is None:
+            entry = self.stages[stage] = [0.0, 0, None]
+        return entry
+
+    def mark(self, stage, detail=None):
+        now = time.perf_counter()
+        entry = self._entry(stage)
+        entry[0] += now - self._last
+        entry[1] += 1
+        if detail is not None:
+            entry[2] = detail
+        self._last = now
+
+    def add_counts(self, stage, counts):
+        """
+        Add (name, count) pairs to a stage's detail without timing anything. Counts are summed over
+        every call, so a Raffle Batch reports the totals of all its prompts instead of the last one's.
+        """
+        totals = self._counts.setdefault(stage, {})
+        for name, count in counts:
+            totals[name] = totals.get(name, 0) + count
+        self._entry(stage)[2] = ", ".join(f"{name} {count}" for name, count in totals.items())
+
+    def report(self):
+        lines = ["-- Timings --"]
+        for stage, (seconds, calls, detail) in self.stages.items():
+            line = f"{stage}: {seconds * 1000:.2f} ms"
+            if calls > 1:
+                line += f" ({calls} calls)"
+            if detail is not None:
+                line += f" [{detail}]"
+            lines.append(line)
+        lines.append(f"total: {(time.perf_counter() - self._start) * 1000:.2f} ms")
+        return "\n".join(lines)
+
+
+class NoTimings:
+    """Stand-in for StageTimings when timings are disabled, so recording a stage costs one no-op call"""
+    enabled = False
+
+    def restart(self):
+        pass
+
+    def mark(self, stage, detail=None):
+        pass
+
+    def add_counts(self, stage, counts):
+        pass
+
+
+NO_TIMINGS = NoTimings()
@@ -1,8 +1,8 @@
-import os
 import re
 
-# Import the global categories list from raffle.py
-from .raffle import ALL_CATEGORIES
+# Import the global categories list and the shared tag-to-category lookup
+from .category_registry import ALL_CATEGORIES, get_category_registry
+from .tag_tokenizer import normalize_tags_cached
 
 class TagCategoryStrength:
     @classmethod
@@ -38,47 +38,6 @@ class TagCategoryStrength:
     )
     FUNCTION = "adjust_tag_categories"
 
-    def __init__(self):
-        self._tag_to_category_cache = None
-
-
-
-    def _load_tag_categories(self):
-        """Load the tag-to-category mapping from categorized_tags.txt"""
-        if self._tag_to_category_cache is not None:
-            return self._tag_to_category_cache
-
-        extension_path = os.path.normpath(os.path.dirname(__file__))
-        categorized_tags_file_path = os.path.join(extension_path, "lists", "categorized_tags.txt")
-        
-        if not os.path.exists(categorized_tags_file_path):
-            raise ValueError(f"Categorized tags file not found at {categorized_tags_file_path}")
-
-        tag_to_category = {}
-        
-        try:
-            with open(categorized_tags_file_path, 'r', encoding='utf-8') as f:
-                for line in f:
-                    line = line.strip()
-                    if not line:
-                        continue
-                    
-                    # Parse format: [category] tag
-                    parts = line.split('] ', 1)
-                    if len(parts) != 2:
-                        continue
-                        
-                    category = parts[0][1:]  # Remove the leading [
-                    tag = parts[1]
-                    
-                    tag_to_category[tag] = category
-                    
-        except Exception as e:
-            raise ValueError(f"Error reading categorized tags file: {str(e)}")
-
-        self._tag_to_category_cache = tag_to_category
-        return tag_to_category
-
     def _parse_category_adjustments(self, adjustments_string):
         """Parse category adjustments from string format like (category:strength)"""
         adjustments = {}
@@ -120,22 +79,8 @@ class TagCategoryStrength:
 
     def _normalize_tags(self, tag_string):
         """Normalize a string of tags to a consistent format"""
-        # Replace newlines with commas
-        tag_string = tag_string.replace('\r\n', '\n')
-        tag_string = tag_string.replace('\n', ',')
-        
-        # Remove multiple consecutive spaces
-        while '  ' in tag_string:
-            tag_string = tag_string.replace('  ', ' ')
-            
-        # Remove multiple consecutive commas
-        while ',,' in tag_string:
-            tag_string = tag_string.replace(',,', ',')
-        
-        # Split on commas and normalize each tag
-        tags = tag_string.replace(', ', ',').split(',')
-        
-        return [tag.strip() for tag in tags if tag.strip()]
+        # Same tokenizer as Raffle, keeping spaces inside tags
+        return list(normalize_tags_cached(tag_string, underscores=False))
 
     def _extract_tag_and_weight(self, tag):
         """Extract tag name and existing weight from a tag like 'tag' or '(tag:1.2)'"""
@@ -165,7 +110,7 @@ class TagCategoryStrength:
 
     def adjust_tag_categories(self, input_tags, category_adjustments, preserve_existing_weights=True):
         # Load tag-to-category mapping
-        tag_to_category = self._load_tag_categories()
+        category_registry = get_category_registry()
         
         # Parse category adjustments
         adjustments = self._parse_category_adjustments(category_adjustments)
@@ -187,7 +132,7 @@ class TagCategoryStrength:
             normalized_tag_name = tag_name.replace(' ', '_')
             
             # Find category for this tag
-            category = tag_to_category.get(normalized_tag_name)
+            category = category_registry.get_category(normalized_tag_name)
             
             if category and category in adjustments:
                 # This tag has a category adjustment
@@ -0,0 +1,36 @@
+from itertools import compress
+
+# A query that may match more than 1 in this many taglists of a file is evaluated on columns,
+# and the columns of tags at least this common are worth caching
+LANES_RATIO = 8
+
+
+def line_flags(line_ids, line_count):
+    """One byte per taglist, 1 for the given line ids"""
+    flags = bytearray(line_count)
+    for line_id in line_ids:
+        flags[line_id] = 1
+    return flags
+
+
+def to_lanes(values):
+    """
+    A column of one value per taglist (bytes, or an array of wider counts) as one big integer,
+    so an operation on it works on every taglist at once
+    """
+    return int.from_bytes(values, 'little')
+
+
+def all_lanes(line_count):
+    """The column of one byte per taglist with every taglist set"""
+    return to_lanes(b'\x01' * line_count)
+
+
+def count_lanes(lanes, line_count):
+    """How many taglists are set in a column of 0/1 bytes"""
+    return lanes.to_bytes(line_count, 'little').count(1)
+
+
+def lanes_line_ids(lanes, line_count):
+    """The line ids set in a column of 0/1 bytes, in file order"""
+    return compress(range(line_count), lanes.to_bytes(line_count, 'little'))
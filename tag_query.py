@@ -0,0 +1,309 @@
+from array import array
+from bisect import bisect_left
+
+from .tag_columns import LANES_RATIO, to_lanes, all_lanes, lanes_line_ids
+
+# Query operators; danbooru tags are lower case, so these never clash with a tag
+QUERY_KEYWORDS = ("AND", "OR", "NOT")
+# A posting list is binary searched per candidate instead of scanned when it is this many times larger
+PROBE_RATIO = 16
+
+
+def _restrict(postings, candidates):
+    """The line ids of a sorted posting list, limited to candidates (None means no limit)"""
+    if candidates is None:
+        return set(postings)
+    if len(postings) <= PROBE_RATIO * len(candidates):
+        return candidates.intersection(postings)
+    # Few candidates against a long posting list: look each one up instead of reading the whole list
+    found = set()
+    size = len(postings)
+    for line_id in candidates:
+        position = bisect_left(postings, line_id)
+        if position < size and postings[position] == line_id:
+            found.add(line_id)
+    return found
+
+
+def _union(taglist_file, parts, candidates):
+    """
+    Union of sub-queries, each evaluated only on the candidates not matched yet.
+    The largest parts go first, so later ones have the fewest candidates left to check.
+    """
+    parts = sorted(parts, key=lambda part: part.estimate(taglist_file), reverse=True)
+    if candidates is None:
+        result = set()
+        for part in parts:
+            result.update(part.evaluate(taglist_file, None))
+        return result
+
+    remaining = set(candidates)
+    for part in parts:
+        if not remaining:
+            break
+        remaining.difference_update(part.evaluate(taglist_file, remaining))
+    return candidates - remaining
+
+
+class TagTerm:
+    """Taglists containing one exact tag"""
+
+    def __init__(self, tag):
+        self.tag = tag
+
+    def estimate(self, taglist_file):
+        return len(taglist_file.get_postings(self.tag))
+
+    def evaluate(self, taglist_file, candidates):
+        return _restrict(taglist_file.get_postings(self.tag), candidates)
+
+    def postings(self, taglist_file):
+        return taglist_file.get_postings(self.tag)
+
+    def lanes(self, taglist_file):
+        return taglist_file.get_lanes(self.tag)
+
+    def __str__(self):
+        return self.tag
+
+
+class WildcardTerm:
+    """Taglists containing any tag matching a * pattern, expanded against the file's vocabulary"""
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+
+    def estimate(self, taglist_file):
+        return len(taglist_file.get_pattern_postings(self.pattern))
+
+    def evaluate(self, taglist_file, candidates):
+        return _restrict(taglist_file.get_pattern_postings(self.pattern), candidates)
+
+    def postings(self, taglist_file):
+        return taglist_file.get_pattern_postings(self.pattern)
+
+    def lanes(self, taglist_file):
+        return taglist_file.get_lanes(self.pattern)
+
+    def __str__(self):
+        return self.pattern
+
+
+class NotQuery:
+    """Taglists not matched by a sub-query"""
+
+    def __init__(self, child):
+        self.child = child
+
+    def estimate(self, taglist_file):
+        return max(0, taglist_file.line_count - self.child.estimate(taglist_file))
+
+    def evaluate(self, taglist_file, candidates):
+        if candidates is None:
+            candidates = set(range(taglist_file.line_count))
+        return candidates - self.child.evaluate(taglist_file, candidates)
+
+    def lanes(self, taglist_file):
+        return all_lanes(taglist_file.line_count) ^ self.child.lanes(taglist_file)
+
+    def __str__(self):
+        return f"NOT {self.child}"
+
+
+class OrQuery:
+    """Taglists matched by any sub-query"""
+
+    def __init__(self, children):
+        self.children = children
+
+    def estimate(self, taglist_file):
+        return min(taglist_file.line_count, sum(child.estimate(taglist_file) for child in self.children))
+
+    def evaluate(self, taglist_file, candidates):
+        return _union(taglist_file, self.children, candidates)
+
+    def lanes(self, taglist_file):
+        # Rare tags (e.g. the excluded ones) are all marked in one column instead of one column each
+        line_count = taglist_file.line_count
+        flags = bytearray(line_count)
+        lanes = 0
+        for child in self.children:
+            postings = child.postings(taglist_file) if isinstance(child, (TagTerm, WildcardTerm)) else None
+            if postings is not None and LANES_RATIO * len(postings) < line_count:
+                for line_id in postings:
+                    flags[line_id] = 1
+            else:
+                lanes |= child.lanes(taglist_file)
+        return lanes | to_lanes(flags)
+
+    def __str__(self):
+        return "(" + " OR ".join(str(child) for child in self.children) + ")"
+
+
+class AndQuery:
+    """
+    Taglists matched by every sub-query.
+    The planner evaluates the most selective sub-query first (by the file's posting list sizes),
+    and every later one only on the taglists still left, with NOT sub-queries last.
+    """
+
+    def __init__(self, children):
+        self.children = children
+
+    def estimate(self, taglist_file):
+        positive = [child.estimate(taglist_file) for child in self.children if not isinstance(child, NotQuery)]
+        return min(positive) if positive else taglist_file.line_count
+
+    def plan(self, taglist_file):
+        """Sub-queries in evaluation order"""
+        positive = sorted((child for child in self.children if not isinstance(child, NotQuery)),
+                          key=lambda child: child.estimate(taglist_file))
+        negative = [child for child in self.children if isinstance(child, NotQuery)]
+        return positive + negative
+
+    def evaluate(self, taglist_file, candidates):
+        for child in self.plan(taglist_file):
+            candidates = child.evaluate(taglist_file, candidates)
+            if not candidates:
+                return set()
+        return candidates
+
+    def lanes(self, taglist_file):
+        lanes = all_lanes(taglist_file.line_count)
+        for child in self.plan(taglist_file):
+            lanes &= child.lanes(taglist_file)
+            if not lanes:
+                break
+        return lanes
+
+    def __str__(self):
+        return "(" + " AND ".join(str(child) for child in self.children) + ")"
+
+
+def _tokenize_query(text):
+    """
+    Split a query into '(', ')', ',', keywords and tags.
+    Parentheses inside a tag (e.g. 'hatsune_miku_(append)') stay part of it, so only
+    an unbalanced ')' ends a tag.
+    """
+    tokens = []
+    position = 0
+    while position < len(text):
+        char = text[position]
+        if char.isspace():
+            position += 1
+        elif char in "(),":
+            tokens.append(char)
+            position += 1
+        else:
+            start = position
+            depth = 0
+            while position < len(text) and not text[position].isspace() and text[position] != ',':
+                if text[position] == '(':
+                    depth += 1
+                elif text[position] == ')':
+                    if depth == 0:
+                        break
+                    depth -= 1
+                position += 1
+            tokens.append(text[start:position])
+    return tokens
+
+
+class _QueryParser:
+    """
+    Recursive descent parser for:
+        query   := or_expr (',' or_expr)*          commas separate required parts, like in taglists_must_include
+        or_expr := and_expr ('OR' and_expr)*
+        and_expr:= unary ('AND' unary)*
+        unary   := 'NOT' unary | '(' or_expr ')' | tag
+    """
+
+    def __init__(self, text):
+        self.tokens = _tokenize_query(text)
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def take(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def parse(self):
+        parts = []
+        while self.peek() is not None:
+            if self.peek() == ',':
+                self.take()
+                continue
+            parts.append(self.or_expr())
+            if self.peek() not in (None, ','):
+                token = self.peek()
+                if token in QUERY_KEYWORDS or token in ("(", ")"):
+                    raise ValueError(f"Invalid taglist_query: unexpected '{token}'")
+                raise ValueError(f"Invalid taglist_query: expected AND, OR or ',' before '{token}' "
+                                 f"(tags in a query use underscores instead of spaces)")
+        if not parts:
+            return None
+        return parts[0] if len(parts) == 1 else AndQuery(parts)
+
+    def or_expr(self):
+        children = [self.and_expr()]
+        while self.peek() == "OR":
+            self.take()
+            children.append(self.and_expr())
+        return children[0] if len(children) == 1 else OrQuery(children)
+
+    def and_expr(self):
+        children = [self.unary()]
+        while self.peek() == "AND":
+            self.take()
+            children.append(self.unary())
+        return children[0] if len(children) == 1 else AndQuery(children)
+
+    def unary(self):
+        token = self.take()
+        if token == "NOT":
+            return NotQuery(self.unary())
+        if token == "(":
+            node = self.or_expr()
+            if self.take() != ")":
+                raise ValueError("Invalid taglist_query: missing ')'")
+            return node
+        if token is None or token in QUERY_KEYWORDS or token in (")", ","):
+            found = "end of query" if token is None else f"'{token}'"
+            raise ValueError(f"Invalid taglist_query: expected a tag, found {found}")
+        if '*' in token:
+            return WildcardTerm(token)
+        return TagTerm(token)
+
+
+def parse_tag_query(text):
+    """
+    Parse a taglist query such as '1girl AND (beach OR pool) AND NOT *_tail'.
+    Returns None for an empty query and raises ValueError for a malformed one.
+    """
+    return _QueryParser(text).parse()
+
+
+def query_taglists(taglist_file, query, must_include_tags=None, exclude_tags=None):
+    """
+    Line ids (in file order) of the taglists matching a parsed query as well as
+    the must-include and exclude tags, planned together as a single AND.
+
+    Selective queries are evaluated as sets of line ids, so every step only looks at the candidates
+    left by the steps before it. A query that may match a large part of the file (a common tag, a broad
+    wildcard, a NOT) is evaluated on columns of one byte per taglist packed into big integers instead,
+    where AND, OR and NOT each cost a few passes in C however many taglists match.
+    """
+    children = [TagTerm(tag) for tag in must_include_tags or ()]
+    children.append(query)
+    if exclude_tags:
+        # One NOT over all excluded tags removes them in a single pass over the candidates
+        children.append(NotQuery(OrQuery([TagTerm(tag) for tag in exclude_tags])))
+    query = AndQuery(children)
+    line_count = taglist_file.line_count
+    if LANES_RATIO * query.estimate(taglist_file) < line_count:
+        return array('I', sorted(query.evaluate(taglist_file, None)))
+    return array('I', lanes_line_ids(query.lanes(taglist_file), line_count))
@@ -0,0 +1,38 @@
+from functools import lru_cache
+
+# How many distinct widget strings keep their normalized form cached
+NORMALIZE_CACHE_SIZE = 256
+
+
+def tokenize_tags(tag_string, underscores=True):
+    """
+    Split a string of tags into normalized tags in a single pass:
+    - Newlines and commas both separate tags
+    - Each tag is stripped and runs of spaces inside it collapse to one
+    - With underscores=True the remaining spaces become underscores (danbooru form)
+    - Empty tags are dropped
+
+    Examples:
+        "red hair, blue hair"     -> ["red_hair", "blue_hair"]
+        "red   hair,\\nblue_hair" -> ["red_hair", "blue_hair"]
+        "red hair,,blue_hair"     -> ["red_hair", "blue_hair"]
+    """
+    separator = '_' if underscores else ' '
+    tags = []
+    for tag in tag_string.replace('\r\n', '\n').replace('\n', ',').split(','):
+        tag = tag.strip()
+        if not tag:
+            continue
+        if ' ' in tag:
+            tag = separator.join(part for part in tag.split(' ') if part)
+        tags.append(tag)
+    return tags
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def normalize_tags_cached(tag_string, underscores=True):
+    """
+    Memoized tokenize_tags for widget strings that rarely change between runs (filter lists, negative prompt).
+    Returns a tuple so the cached result can't be modified by a caller.
+    """
+    return tuple(tokenize_tags(tag_string, underscores))
@@ -0,0 +1,866 @@
+import os
+import sys
+import json
+import mmap
+import struct
+import hashlib
+import threading
+import contextlib
+import subprocess
+from array import array
+from collections import OrderedDict
+from itertools import filterfalse, compress
+
+from .compressed_taglists import read_compressed_taglists, COMPRESSED_EXTENSIONS, zstandard
+from .tag_columns import LANES_RATIO, line_flags, to_lanes, all_lanes, count_lanes
+from .mapped_tables import vocabulary_arrays, MappedVocabulary, MappedTagIds
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: processes starting at the same time may each build an index (the last one written wins)
+    fcntl = None
+
+# --- Constants ---
+EXTENSION_PATH = os.path.normpath(os.path.dirname(__file__))
+LISTS_PATH = os.path.join(EXTENSION_PATH, "lists")
+# Compiled indexes are cached next to the list files they were built from
+INDEX_CACHE_PATH = os.path.join(LISTS_PATH, "index_cache")
+
+# Rating name -> taglist file in the lists folder
+RATING_FILES = {
+    "general": "taglists-general.txt",
+    "questionable": "taglists-questionable.txt",
+    "sensitive": "taglists-sensitive.txt",
+    "explicit": "taglists-explicit.txt",
+}
+
+INDEX_MAGIC = b"RAFFLEIX"
+INDEX_VERSION = 5
+
+# Most worker processes used to build missing indexes in parallel (one file per worker)
+INDEX_BUILD_WORKERS = os.cpu_count() or 1
+# Script a worker process runs to build one index (see index_build_worker.py)
+INDEX_BUILD_WORKER_PATH = os.path.join(EXTENSION_PATH, "index_build_worker.py")
+
+# Lines appended to a list file are indexed as a separate delta segment; once it holds
+# more lines than this it is merged into the main index on a background thread
+DELTA_MERGE_LINES = 20000
+# Bytes before the indexed end of a list file that must be unchanged for it to count as appended to
+APPEND_CHECK_BYTES = 4096
+
+# Bounds for the per-file cache of merged wildcard pattern posting lists
+PATTERN_CACHE_MAX_ENTRIES = 16
+PATTERN_CACHE_MAX_BYTES = 8 * 1024 * 1024
+# Bounds for the per-file cache of the columns (see tag_columns.py) of common tags and patterns
+COLUMN_CACHE_MAX_ENTRIES = 16
+COLUMN_CACHE_MAX_BYTES = 16 * 1024 * 1024
+
+# Bounds for the cache of filtered taglist pools
+POOL_CACHE_MAX_ENTRIES = 32
+POOL_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+
+def _write_index_file(path, header, arrays):
+    """
+    Write a header dict followed by named arrays into a single index file.
+    Every array starts on an 8-byte boundary so it can be mapped back in place.
+    """
+    layout = {}
+    offset = 0
+    for name, values in arrays.items():
+        layout[name] = [values.typecode, offset, len(values)]
+        offset += (len(values) * values.itemsize + 7) // 8 * 8
+
+    header = dict(header, version=INDEX_VERSION, arrays=layout)
+    header_bytes = json.dumps(header).encode('utf-8')
+    header_bytes += b' ' * (-len(header_bytes) % 8)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a private temp file first so readers never see a half written index
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(INDEX_MAGIC)
+            f.write(struct.pack('<Q', len(header_bytes)))
+            f.write(header_bytes)
+            for values in arrays.values():
+                data = values.tobytes()
+                f.write(data)
+                f.write(b'\0' * (-len(data) % 8))
+        os.replace(tmp_path, path)
+    finally:
+        # Only still there if writing or renaming it failed
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+
+
+def _read_index_file(path):
+    """
+    Memory-map an index file written by _write_index_file.
+    Returns (header, arrays) where each array is a zero-copy memoryview, or None if the file is missing or unreadable.
+    """
+    try:
+        with open(path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    try:
+        if mm[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+            return None
+        header_start = len(INDEX_MAGIC) + 8
+        (header_length,) = struct.unpack('<Q', mm[len(INDEX_MAGIC):header_start])
+        header = json.loads(mm[header_start:header_start + header_length].decode('utf-8'))
+        if header.get('version') != INDEX_VERSION:
+            return None
+
+        data_start = header_start + header_length
+        view = memoryview(mm)
+        arrays = {}
+        for name, (typecode, offset, count) in header['arrays'].items():
+            start = data_start + offset
+            end = start + count * array(typecode).itemsize
+            if end > len(mm):
+                return None
+            arrays[name] = view[start:end].cast(typecode)
+        return header, arrays
+    except (ValueError, KeyError, TypeError, struct.error):
+        return None
+
+
+def _source_stamp(filepath):
+    """Size and mtime of a list file, used to detect when its index is stale"""
+    stat = os.stat(filepath)
+    return {"source_size": stat.st_size, "source_mtime_ns": stat.st_mtime_ns}
+
+
+def _index_path(filepath, generation=0):
+    """Where a generation of the compiled index of a list file is cached (generation 0 also names its lock and delta)"""
+    path = os.path.join(INDEX_CACHE_PATH, os.path.basename(filepath) + ".index")
+    return f"{path}.{generation}" if generation else path
+
+
+def _index_generations(filepath):
+    """
+    Generations of the cached index of a list file that exist, oldest first.
+    A rebuilt or merged index is written as the next generation instead of over the current file,
+    which may still be mapped (Windows can't replace a mapped file), and the newest one is loaded.
+    """
+    prefix = os.path.basename(_index_path(filepath)) + "."
+    try:
+        names = os.listdir(INDEX_CACHE_PATH)
+    except OSError:
+        return []
+    generations = [int(name[len(prefix):]) for name in names if name.startswith(prefix) and name[len(prefix):].isdigit()]
+    if os.path.basename(_index_path(filepath)) in names:
+        generations.append(0)
+    return sorted(generations)
+
+
+def _current_index_path(filepath):
+    """Path of the newest generation of the cached index of a list file"""
+    generations = _index_generations(filepath)
+    return _index_path(filepath, generations[-1] if generations else 0)
+
+
+def _write_index_generation(filepath, header, arrays):
+    """Write an index as the next generation, then remove the older ones that nothing maps any more"""
+    generations = _index_generations(filepath)
+    _write_index_file(_index_path(filepath, generations[-1] + 1 if generations else 0), header, arrays)
+    for generation in generations:
+        # Fails on Windows while a generation is still mapped; it is tried again after the next write
+        with contextlib.suppress(OSError):
+            os.remove(_index_path(filepath, generation))
+
+
+def _delta_path(filepath):
+    """Where the delta segment for lines appended to a list file is cached"""
+    return _index_path(filepath) + ".delta"
+
+
+def _tail_hash(filepath, size):
+    """
+    Hash of the last APPEND_CHECK_BYTES bytes of the first size bytes of a file,
+    or None if they don't end in a newline (an append would then extend the last line).
+    """
+    with open(filepath, 'rb') as f:
+        f.seek(max(0, size - APPEND_CHECK_BYTES))
+        tail = f.read(min(size, APPEND_CHECK_BYTES))
+    if len(tail) != min(size, APPEND_CHECK_BYTES) or not tail.endswith(b'\n'):
+        return None
+    return hashlib.blake2b(tail, digest_size=16).hexdigest()
+
+
+def _raw_bytes(values):
+    """Bytes view of an array or a typed memoryview, for array.frombytes"""
+    return memoryview(values).cast('B')
+
+
+@contextlib.contextmanager
+def _index_build_lock(index_path):
+    """
+    Hold an exclusive lock on <index>.lock while an index is built, so when several ComfyUI processes
+    start together the first one builds it and the others wait and then map the finished file.
+    """
+    if fcntl is None:
+        yield
+        return
+    try:
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        lock_file = open(index_path + ".lock", 'a')
+    except OSError:
+        yield
+        return
+    with lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _postings_size(postings):
+    return len(postings) * postings.itemsize
+
+
+def _lanes_size(lanes):
+    return (lanes.bit_length() + 7) // 8
+
+
+def split_taglist(taglist):
+    """
+    Split a taglist line into (score, tags).
+    The leading post_id and score values (see lists/!notes.txt) are not tags; lines without them get a score of 0.
+    """
+    tags = [tag.strip() for tag in taglist.split(',')]
+    if len(tags) >= 2 and tags[0].isdigit() and tags[1].lstrip('-').isdigit():
+        return int(tags[1]), tags[2:]
+    return 0, tags
+
+
+class TaglistFile:
+    """
+    Byte-offset index and inverted tag index over one taglists-*.txt file.
+
+    The file is memory-mapped and only the start offset of every non-empty line is kept,
+    so a pool of taglists can be held as line ids and a line is only decoded when it is needed.
+    For every tag the sorted ids of the lines containing it are stored as a posting list,
+    which turns the include/exclude filters into set algebra instead of a scan of the file.
+    The danbooru score of every line is kept too, for score-weighted sampling.
+
+    Lines appended to the file after its index was built (e.g. by the taglist scraper) are indexed
+    on their own as a delta segment, so they are available without re-reading the rest of the file.
+    """
+
+    # Whether lines appended to the source file can be indexed as a delta segment
+    supports_delta = True
+
+    def __init__(self, filename, filepath=None):
+        self.filename = filename
+        self.filepath = filepath or os.path.join(LISTS_PATH, filename)
+        self.stamp = _source_stamp(self.filepath)
+        self._mm = None
+        self.delta = None
+        self.delta_line_count = 0
+
+        arrays, delta_arrays = self._load_index()
+        if arrays is None:
+            with _index_build_lock(_index_path(self.filepath)):
+                # Another process may have built it while this one waited for the lock
+                arrays, delta_arrays = self._load_index()
+                if arrays is None:
+                    arrays = self._build_index()
+                    try:
+                        _write_index_generation(self.filepath, self._index_header(), arrays)
+                    except OSError as e:
+                        print(f"[Raffle] Could not save taglist index for {filename}: {e}")
+                    else:
+                        # Map the written file, so this process shares its pages with every other one
+                        loaded = _read_index_file(_current_index_path(self.filepath))
+                        if loaded is not None:
+                            arrays = loaded[1]
+
+        self.posting_starts = arrays["posting_starts"]
+        self.postings = arrays["postings"]
+        # Tags are looked up in the mapped index itself rather than copied into a list and dict
+        self.vocabulary = MappedVocabulary(arrays)
+        self.tag_ids = MappedTagIds(arrays, self.vocabulary)
+        # Wildcard pattern -> merged posting list of the matching tags
+        self._pattern_postings = PoolCache(PATTERN_CACHE_MAX_ENTRIES, PATTERN_CACHE_MAX_BYTES,
+                                           size_of=_postings_size, name="Pattern cache")
+        # Common tag or pattern -> its column
+        self._columns = PoolCache(COLUMN_CACHE_MAX_ENTRIES, COLUMN_CACHE_MAX_BYTES,
+                                  size_of=_lanes_size, name="Column cache")
+        self._attach(arrays)
+        if delta_arrays is not None:
+            self._attach_delta(delta_arrays)
+
+    def _load_index(self):
+        """
+        Map the newest cached index if it was built from the current file. Returns (arrays, delta arrays),
+        with a delta segment when lines were only appended since, or (None, None) if it has to be rebuilt.
+        """
+        loaded = _read_index_file(_current_index_path(self.filepath))
+        if loaded is None:
+            return None, None
+        header, arrays = loaded
+        if all(header.get(k) == v for k, v in self.stamp.items()):
+            return arrays, None
+        if self._is_appended_to(header):
+            return arrays, self._get_delta(header, len(arrays["offsets"]))
+        return None, None
+
+    def _index_header(self):
+        """Header of an index built from the current file: its stamp, plus what's needed to recognise appends later"""
+        if not self.supports_delta:
+            return self.stamp
+        return dict(self.stamp, tail_hash=_tail_hash(self.filepath, self.stamp["source_size"]))
+
+    def _is_appended_to(self, header):
+        """True if the file is the one an index was built from with only lines appended to it since"""
+        indexed_size = header.get("source_size")
+        if not self.supports_delta or header.get("tail_hash") is None or not isinstance(indexed_size, int):
+            return False
+        if not 0 < indexed_size < self.stamp["source_size"]:
+            return False
+        return _tail_hash(self.filepath, indexed_size) == header["tail_hash"]
+
+    def _get_delta(self, base_header, base_line_count):
+        """Load the delta segment for the appended lines, or index them (and only them) now"""
+        delta_path = _delta_path(self.filepath)
+        header = dict(self.stamp, base_size=base_header["source_size"], base_mtime_ns=base_header.get("source_mtime_ns"))
+        loaded = _read_index_file(delta_path)
+        if loaded is not None and all(loaded[0].get(k) == v for k, v in header.items()):
+            return loaded[1]
+
+        delta_arrays = self._build_index(base_header["source_size"], base_line_count)
+        print(f"[Raffle] Indexed {len(delta_arrays['offsets'])} taglists appended to {self.filename}")
+        try:
+            _write_index_file(delta_path, header, delta_arrays)
+        except OSError as e:
+            print(f"[Raffle] Could not save taglist index for {self.filename}: {e}")
+        return delta_arrays
+
+    def _attach(self, arrays):
+        """Keep the line lookup arrays and map the list file for reading single lines"""
+        self.offsets = arrays["offsets"]
+        self.scores = arrays["scores"]
+        self.line_count = len(self.offsets)
+        if self.stamp["source_size"] > 0:
+            with open(self.filepath, 'rb') as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @staticmethod
+    def _posting_arrays(vocabulary, tag_postings):
+        """Flatten per-tag posting lists into one array, with posting_starts marking where each tag's list begins"""
+        posting_starts = array('Q', [0])
+        postings = array('I')
+        for posting in tag_postings:
+            postings.extend(posting)
+            posting_starts.append(len(postings))
+        return dict(vocabulary_arrays(vocabulary), posting_starts=posting_starts, postings=postings)
+
+    def _attach_delta(self, delta_arrays):
+        """
+        Add the delta segment of appended lines. Line ids continue after the base index, so the
+        line lookups are extended in place while posting lists are joined per tag when asked for.
+        """
+        self.delta = delta_arrays
+        self.delta_line_count = len(delta_arrays["offsets"])
+        self.base_tag_count = len(self.vocabulary)
+        delta_vocabulary = MappedVocabulary(delta_arrays)
+        self.delta_tag_ids = MappedTagIds(delta_arrays, delta_vocabulary)
+        for tag in delta_vocabulary:
+            if tag not in self.tag_ids:
+                self.tag_ids[tag] = len(self.vocabulary)
+                self.vocabulary.append(tag)
+
+        for name, typecode in (("offsets", 'Q'), ("scores", 'q')):
+            combined = array(typecode)
+            combined.frombytes(_raw_bytes(getattr(self, name)))
+            combined.frombytes(_raw_bytes(delta_arrays[name]))
+            setattr(self, name, combined)
+        self.line_count = len(self.offsets)
+
+    def merge_delta(self):
+        """
+        Write the base index and delta segment as one index for the current file, and drop the delta segment.
+        The merged index is a new generation, so the one this TaglistFile maps stays valid until it is reloaded.
+        """
+        arrays = dict(
+            self._posting_arrays(self.vocabulary, (self.get_postings(tag) for tag in self.vocabulary)),
+            offsets=self.offsets,
+            scores=self.scores,
+        )
+        with _index_build_lock(_index_path(self.filepath)):
+            _write_index_generation(self.filepath, self._index_header(), arrays)
+        try:
+            os.remove(_delta_path(self.filepath))
+        except OSError:
+            pass
+
+    def _build_index(self, start=0, first_line_id=0):
+        """
+        Scan the file once, recording where every non-empty line starts and which lines each tag appears in.
+        start and first_line_id index only the lines from a byte offset on, for a delta segment.
+        """
+        offsets = array('Q')
+        scores = array('q')
+        tag_postings = {}
+        position = start
+        with open(self.filepath, 'rb') as f:
+            f.seek(start)
+            for line in f:
+                if line.strip():
+                    line_id = first_line_id + len(offsets)
+                    offsets.append(position)
+                    score, tags = split_taglist(line.decode('utf-8'))
+                    scores.append(score)
+                    for tag in set(tags):
+                        posting = tag_postings.get(tag)
+                        if posting is None:
+                            posting = tag_postings[tag] = array('I')
+                        posting.append(line_id)
+                position += len(line)
+
+        return dict(self._posting_arrays(list(tag_postings), tag_postings.values()), offsets=offsets, scores=scores)
+
+    def is_stale(self):
+        """True if the file on disk no longer matches the one this index was built from"""
+        try:
+            return _source_stamp(self.filepath) != self.stamp
+        except OSError:
+            return True
+
+    def __len__(self):
+        return self.line_count
+
+    def get_postings(self, tag):
+        """Sorted line ids of the taglists containing a tag"""
+        tag_id = self.tag_ids.get(tag)
+        if tag_id is None:
+            return self.postings[0:0]
+        if self.delta is None:
+            return self.postings[self.posting_starts[tag_id]:self.posting_starts[tag_id + 1]]
+
+        # Delta line ids all come after the base ones, so joining the two lists keeps them sorted
+        postings = array('I')
+        if tag_id < self.base_tag_count:
+            start, end = self.posting_starts[tag_id], self.posting_starts[tag_id + 1]
+            postings.frombytes(_raw_bytes(self.postings[start:end]))
+        delta_tag_id = self.delta_tag_ids.get(tag)
+        if delta_tag_id is not None:
+            start, end = self.delta["posting_starts"][delta_tag_id], self.delta["posting_starts"][delta_tag_id + 1]
+            postings.frombytes(_raw_bytes(self.delta["postings"][start:end]))
+        return postings
+
+    def get_pattern_postings(self, pattern):
+        """
+        Sorted line ids of the taglists containing any tag that matches a * wildcard pattern.
+        The pattern is matched against the vocabulary in one regex pass and its posting lists merged once,
+        then kept in a bounded LRU cache, since a broad pattern such as a bare * holds nearly every line id.
+        """
+        postings = self._pattern_postings.get(pattern)
+        if postings is None:
+            line_ids = set()
+            for tag_id in self.vocabulary.find(pattern):
+                line_ids.update(self._get_postings_by_id(tag_id))
+            postings = array('I', sorted(line_ids))
+            self._pattern_postings.put(pattern, postings)
+        return postings
+
+    def _get_postings_by_id(self, tag_id):
+        """get_postings for a tag id, skipping the tag lookup when there's no delta segment"""
+        if self.delta is None:
+            return self.postings[self.posting_starts[tag_id]:self.posting_starts[tag_id + 1]]
+        return self.get_postings(self.vocabulary[tag_id])
+
+    def get_lanes(self, tag):
+        """
+        Column of a tag or * pattern: one byte per taglist, 1 for the taglists containing it, packed into
+        a big integer. Marking a posting list costs a Python loop over it, so the columns of common tags are kept.
+        """
+        lanes = self._columns.get(tag)
+        if lanes is None:
+            postings = self.get_pattern_postings(tag) if '*' in tag else self.get_postings(tag)
+            lanes = to_lanes(line_flags(postings, self.line_count))
+            if LANES_RATIO * len(postings) >= self.line_count:
+                self._columns.put(tag, lanes)
+        return lanes
+
+    def find_taglists(self, must_include_tags=None, exclude_tags=None):
+        """
+        Line ids (in file order) of the taglists that contain all of must_include_tags and none of exclude_tags.
+        Required tags are intersected smallest posting list first, excluded tags are removed as a set difference.
+        """
+        if must_include_tags:
+            include_postings = sorted((self.get_postings(tag) for tag in must_include_tags), key=len)
+            candidates = include_postings[0]
+            if len(include_postings) > 1:
+                remaining = set(candidates)
+                for posting in include_postings[1:]:
+                    remaining.intersection_update(posting)
+                # Walking the smallest (sorted) posting list keeps the result in file order
+                candidates = filter(remaining.__contains__, candidates)
+        else:
+            candidates = range(self.line_count)
+
+        if exclude_tags:
+            excluded = set()
+            for tag in exclude_tags:
+                excluded.update(self.get_postings(tag))
+            candidates = filterfalse(excluded.__contains__, candidates)
+
+        return array('I', candidates)
+
+    def filter_impact(self, must_include_tags, exclude_tags):
+        """
+        find_taglists, plus how much each of its filter tags shrinks the pool, without filtering again per tag.
+        Returns (line ids, {include tag: pool size without it}, {exclude tag: taglists only it removes}).
+
+        Each posting list is read once into a column of one byte per taglist, packed into a big integer,
+        so every "all filters but this tag" pool is a few ANDs over whole columns in C.
+        """
+        line_count = self.line_count
+        include_postings = sorted(((tag, self.get_postings(tag)) for tag in must_include_tags), key=lambda item: len(item[1]))
+        exclude_postings = [(tag, self.get_postings(tag)) for tag in exclude_tags]
+
+        # Taglists with at least one excluded tag, and those with two or more
+        excluded, excluded_again = bytearray(line_count), bytearray(line_count)
+        for _, postings in exclude_postings:
+            for line_id in postings:
+                if excluded[line_id]:
+                    excluded_again[line_id] = 1
+                else:
+                    excluded[line_id] = 1
+        ones = all_lanes(line_count)
+        excluded, excluded_again = to_lanes(excluded), to_lanes(excluded_again)
+
+        # leading[i]: not excluded and with include tags before i, trailing[i]: with include tags from i on
+        leading = [ones ^ excluded]
+        trailing = [ones]
+        columns = [self.get_lanes(tag) for tag, _ in include_postings]
+        for column in columns:
+            leading.append(leading[-1] & column)
+        for column in reversed(columns):
+            trailing.append(trailing[-1] & column)
+        trailing.reverse()
+
+        flags = leading[-1].to_bytes(line_count, 'little')
+        smallest = include_postings[0][1] if include_postings else range(line_count)
+        if 3 * len(smallest) < line_count:
+            # A rare include tag: looking up its (sorted) line ids beats walking every flag
+            line_ids = array('I', compress(smallest, map(flags.__getitem__, smallest)))
+        else:
+            line_ids = array('I', compress(range(line_count), flags))
+
+        include_impact = {
+            tag: count_lanes(leading[position] & trailing[position + 1], line_count)
+            for position, (tag, _) in enumerate(include_postings)
+        }
+        # Taglists with every include tag that only one excluded tag removes
+        flags = ((excluded ^ excluded_again) & trailing[0]).to_bytes(line_count, 'little')
+        exclude_impact = {tag: sum(map(flags.__getitem__, postings)) for tag, postings in exclude_postings}
+        return line_ids, include_impact, exclude_impact
+
+    def get_line(self, line_id):
+        """Decode a single taglist line from the memory-mapped file"""
+        start = self.offsets[line_id]
+        end = self._mm.find(b'\n', start)
+        if end == -1:
+            end = len(self._mm)
+        return self._mm[start:end].decode('utf-8').strip()
+
+    def iter_lines(self):
+        """Yield every taglist line in line id order"""
+        for line_id in range(self.line_count):
+            yield self.get_line(line_id)
+
+    def iter_line_tag_ids(self):
+        """Yield the tag ids of every taglist in line id order"""
+        get_tag_id = self.tag_ids.get
+        for line in self.iter_lines():
+            line_tag_ids = map(get_tag_id, split_taglist(line)[1])
+            yield [tag_id for tag_id in line_tag_ids if tag_id is not None]
+
+
+class CompressedTaglistFile(TaglistFile):
+    """
+    TaglistFile over a compressed, dictionary-encoded list (see compressed_taglists.py).
+
+    The compressed file is only streamed when the index is built. The index keeps every taglist
+    as a run of tag ids, so single lines are rebuilt from the vocabulary instead of read from disk.
+    """
+
+    # Compressed lists are rewritten as a whole, so they are always indexed as a whole
+    supports_delta = False
+
+    def _attach(self, arrays):
+        self.line_starts = arrays["line_starts"]
+        self.line_tags = arrays["line_tags"]
+        self.has_meta = arrays["has_meta"]
+        self.post_ids = arrays["post_ids"]
+        self.scores = arrays["scores"]
+        self.line_count = len(self.has_meta)
+
+    def _build_index(self):
+        vocabulary, blocks = read_compressed_taglists(self.filepath)
+        tag_postings = [array('I') for _ in vocabulary]
+        line_starts = array('Q', [0])
+        line_tags = array('I')
+        has_meta = array('B')
+        post_ids = array('Q')
+        scores = array('q')
+
+        for block_has_meta, block_post_ids, block_scores, tag_counts, tag_ids in blocks:
+            position = 0
+            for tag_count in tag_counts:
+                line_id = len(line_starts) - 1
+                line_tag_ids = tag_ids[position:position + tag_count]
+                for tag_id in set(line_tag_ids):
+                    tag_postings[tag_id].append(line_id)
+                position += tag_count
+                line_starts.append(line_starts[-1] + tag_count)
+            line_tags.extend(tag_ids)
+            has_meta.extend(block_has_meta)
+            post_ids.extend(block_post_ids)
+            scores.extend(block_scores)
+
+        return dict(
+            self._posting_arrays(vocabulary, tag_postings),
+            line_starts=line_starts,
+            line_tags=line_tags,
+            has_meta=has_meta,
+            post_ids=post_ids,
+            scores=scores,
+        )
+
+    def get_line(self, line_id):
+        """Rebuild a taglist line from its tag ids"""
+        vocabulary = self.vocabulary
+        tags = ', '.join(vocabulary[tag_id] for tag_id in self.line_tags[self.line_starts[line_id]:self.line_starts[line_id + 1]])
+        if self.has_meta[line_id]:
+            return f"{self.post_ids[line_id]}, {self.scores[line_id]}, {tags}"
+        return tags
+
+    def iter_line_tag_ids(self):
+        line_starts = self.line_starts
+        for line_id in range(self.line_count):
+            yield self.line_tags[line_starts[line_id]:line_starts[line_id + 1]]
+
+
+# Compressed copies already reported as older than their text file
+_stale_copies_reported = set()
+
+
+def resolve_taglist_path(filename):
+    """
+    Path of the file to read for a taglist file name. A compressed copy (filename.zst / filename.gz)
+    is preferred over the plain text file when present, unless the text file was modified after it
+    (e.g. by the taglist scraper), in which case the text file is read and the copy reported once.
+    Returns None if no variant exists.
+    """
+    filepath = os.path.join(LISTS_PATH, filename)
+    try:
+        text_mtime_ns = os.stat(filepath).st_mtime_ns
+    except OSError:
+        text_mtime_ns = None
+    for extension in COMPRESSED_EXTENSIONS:
+        if extension == ".zst" and zstandard is None:
+            continue
+        try:
+            compressed_mtime_ns = os.stat(filepath + extension).st_mtime_ns
+        except OSError:
+            continue
+        if text_mtime_ns is None or compressed_mtime_ns >= text_mtime_ns:
+            return filepath + extension
+        if filepath + extension not in _stale_copies_reported:
+            _stale_copies_reported.add(filepath + extension)
+            print(f"[Raffle] {filename}{extension} is older than {filename}, so {filename} is used. "
+                  f"Run dev/compress-taglists.py again to update it.")
+    if text_mtime_ns is not None:
+        return filepath
+    return None
+
+
+# Indexes shared by every node instance, rebuilt when their file changes
+_taglist_files = {}
+_taglist_files_lock = threading.Lock()
+
+
+def get_loaded_taglist_file(filename):
+    """
+    The TaglistFile for a file if it is already loaded and still matches the file on disk, else None.
+    Never builds or loads an index, for callers that must answer straight away.
+    """
+    with _taglist_files_lock:
+        taglist_file = _taglist_files.get(filename)
+    if taglist_file is None or taglist_file.filepath != resolve_taglist_path(filename) or taglist_file.is_stale():
+        return None
+    return taglist_file
+
+
+def get_taglist_file(filename):
+    """Return the (cached) TaglistFile for a file in the lists folder"""
+    filepath = resolve_taglist_path(filename)
+    if filepath is None:
+        raise FileNotFoundError(f"Taglist file not found: {os.path.join(LISTS_PATH, filename)}")
+
+    with _taglist_files_lock:
+        taglist_file = _taglist_files.get(filename)
+        if taglist_file is None or taglist_file.filepath != filepath or taglist_file.is_stale():
+            taglist_file = _taglist_class(filename, filepath)(filename, filepath)
+            _taglist_files[filename] = taglist_file
+            if taglist_file.delta_line_count > DELTA_MERGE_LINES:
+                _merge_delta_in_background(taglist_file)
+        return taglist_file
+
+
+# Files whose delta segment is being merged into their main index
+_merging_files = set()
+
+
+def _merge_delta_in_background(taglist_file):
+    """Merge a large delta segment into the main index on a daemon thread; the loaded index stays usable meanwhile"""
+    if taglist_file.filepath in _merging_files:
+        return
+    _merging_files.add(taglist_file.filepath)
+
+    def merge():
+        try:
+            taglist_file.merge_delta()
+            print(f"[Raffle] Merged {taglist_file.delta_line_count} appended taglists into the index of {taglist_file.filename}")
+        except OSError as e:
+            print(f"[Raffle] Could not merge the taglist index for {taglist_file.filename}: {e}")
+        finally:
+            _merging_files.discard(taglist_file.filepath)
+
+    threading.Thread(target=merge, name="RaffleIndexMerge", daemon=True).start()
+
+
+def _taglist_class(filename, filepath):
+    return TaglistFile if filepath.endswith(filename) else CompressedTaglistFile
+
+
+def _index_is_current(filepath):
+    """True if the cached index of a list file exists and was built from its current version"""
+    loaded = _read_index_file(_current_index_path(filepath))
+    if loaded is None:
+        return False
+    try:
+        stamp = _source_stamp(filepath)
+    except OSError:
+        return False
+    return all(loaded[0].get(k) == v for k, v in stamp.items())
+
+
+def _build_index_worker(filename, filepath):
+    """Runs in a worker process: build and save the index of one file, so the caller only has to map it"""
+    _taglist_class(filename, filepath)(filename, filepath)
+
+
+def _build_indexes_in_workers(pending):
+    """
+    Build the indexes of (filename, filepath) pairs in worker processes, at most INDEX_BUILD_WORKERS at a time.
+    Each worker is a fresh interpreter running index_build_worker.py, never a fork of this process:
+    the caller may be the warm-up thread, and forking a process with other threads running is unsafe.
+    """
+    for start in range(0, len(pending), INDEX_BUILD_WORKERS):
+        workers = []
+        for filename, filepath in pending[start:start + INDEX_BUILD_WORKERS]:
+            try:
+                workers.append((filename, subprocess.Popen([sys.executable, INDEX_BUILD_WORKER_PATH, filename, filepath])))
+            except OSError as e:
+                print(f"[Raffle] Parallel index build failed for {filename}: {e}")
+        for filename, worker in workers:
+            if worker.wait() != 0:
+                print(f"[Raffle] Parallel index build failed for {filename} (exit code {worker.returncode})")
+
+
+def get_taglist_files(filenames):
+    """
+    Return the (cached) TaglistFile of every file, in the given order.
+
+    Indexes that have to be built first are built in parallel worker processes, one file per worker.
+    Workers only write their index file, which is then loaded here exactly like a cached index,
+    so the result doesn't depend on which worker finished first. An index a worker failed to build
+    is built in this process instead.
+    """
+    pending = []
+    for filename in filenames:
+        filepath = resolve_taglist_path(filename)
+        if filepath is None or get_loaded_taglist_file(filename) is not None:
+            continue
+        if not _index_is_current(filepath):
+            pending.append((filename, filepath))
+
+    if len(pending) > 1 and INDEX_BUILD_WORKERS > 1 and sys.executable:
+        _build_indexes_in_workers(pending)
+
+    return [get_taglist_file(filename) for filename in filenames]
+
+
+class PoolCache:
+    """
+    Bounded LRU cache of filtered taglist pools.
+
+    Entries are evicted least recently used first once either the entry count
+    or the combined size of the cached line id arrays goes over its bound.
+    size_of can be replaced to cache other per-pool data (e.g. alias tables) under the same rules.
+    """
+
+    def __init__(self, max_entries=POOL_CACHE_MAX_ENTRIES, max_bytes=POOL_CACHE_MAX_BYTES, size_of=None, name="Pool cache"):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size_of = size_of or self._pools_size
+        self.name = name
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.size_bytes = 0
+
+    @staticmethod
+    def make_key(taglist_files, must_include_tags, exclude_tags):
+        """Key a pool on the files it was built from (including their size/mtime) and the normalized filters"""
+        files_key = tuple(
+            (f.filepath, f.stamp["source_size"], f.stamp["source_mtime_ns"]) for f in taglist_files
+        )
+        return files_key, frozenset(must_include_tags), frozenset(exclude_tags)
+
+    @staticmethod
+    def _pools_size(pools):
+        return sum(len(line_ids) * line_ids.itemsize for _, line_ids in pools)
+
+    def get(self, key):
+        """Return the cached pools for a key, or None"""
+        with self._lock:
+            pools = self._entries.get(key)
+            if pools is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return pools
+
+    def put(self, key, pools):
+        """Store pools for a key, evicting old entries to stay within the bounds"""
+        size = self.size_of(pools)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.size_bytes -= self.size_of(self._entries.pop(key))
+            self._entries[key] = pools
+            self.size_bytes += size
+            while len(self._entries) > self.max_entries or self.size_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size_bytes -= self.size_of(evicted)
+
+    def stats(self):
+        """One line summary for the Debug info output"""
+        with self._lock:
+            return (f"{self.name}: {self.hits} hits, {self.misses} misses, "
+                    f"{len(self._entries)}/{self.max_entries} entries, "
+                    f"{self.size_bytes / (1024 * 1024):.1f}/{self.max_bytes / (1024 * 1024):.0f} MB")
@@ -0,0 +1,165 @@
+import os
+import math
+import time
+import heapq
+import threading
+from array import array
+
+from .taglist_index import INDEX_CACHE_PATH, _read_index_file, _write_index_file
+from .tag_query import _restrict
+
+
+def build_tfidf(taglist_file):
+    """
+    TF-IDF weights of a taglist file, as the arrays of a sparse taglist x tag matrix that reuses the posting lists.
+
+    A tag appears at most once in a taglist, so its weight in every taglist containing it is just its
+    smoothed idf, log((1 + lines) / (1 + lines containing it)) + 1. Returns:
+    - idf: the idf of every tag id
+    - inverse_norms: 1 / the euclidean norm of every taglist's row (0 for an empty taglist)
+    - max_inverse_norms: the largest inverse norm among the taglists containing each tag, which bounds
+      how much a tag can add to any taglist's similarity
+    """
+    line_count = taglist_file.line_count
+    postings = [taglist_file.get_postings(tag) for tag in taglist_file.vocabulary]
+    idf = array('d', (math.log((1 + line_count) / (1 + len(tag_postings))) + 1 for tag_postings in postings))
+
+    squared_norms = array('d', bytes(8 * line_count))
+    for tag_idf, tag_postings in zip(idf, postings):
+        weight = tag_idf * tag_idf
+        for line_id in tag_postings:
+            squared_norms[line_id] += weight
+    inverse_norms = array('d', (1 / math.sqrt(value) if value else 0.0 for value in squared_norms))
+
+    get_inverse_norm = inverse_norms.__getitem__
+    max_inverse_norms = array('d', (max(map(get_inverse_norm, tag_postings), default=0.0) for tag_postings in postings))
+    return {"idf": idf, "inverse_norms": inverse_norms, "max_inverse_norms": max_inverse_norms}
+
+
+def _tfidf_path(taglist_file):
+    return os.path.join(INDEX_CACHE_PATH, os.path.basename(taglist_file.filepath) + ".tfidf")
+
+
+# TF-IDF arrays per taglist file, for the file version they were built from
+_tfidf = {}
+_tfidf_lock = threading.Lock()
+
+
+def get_tfidf(taglist_file):
+    """
+    TF-IDF arrays of a TaglistFile (see build_tfidf).
+    They are cached next to the taglist index and only rebuilt when the list file changes.
+    """
+    with _tfidf_lock:
+        cached = _tfidf.get(taglist_file.filepath)
+        if cached is not None and cached[0] == taglist_file.stamp:
+            return cached[1]
+
+        header = dict(taglist_file.stamp, line_count=taglist_file.line_count, tag_count=len(taglist_file.vocabulary))
+        path = _tfidf_path(taglist_file)
+        loaded = _read_index_file(path)
+        if loaded is not None and all(loaded[0].get(k) == v for k, v in header.items()):
+            tfidf = loaded[1]
+        else:
+            start = time.perf_counter()
+            tfidf = build_tfidf(taglist_file)
+            print(f"[Raffle] Built the TF-IDF weights of {taglist_file.filename} ({time.perf_counter() - start:.1f}s)")
+            try:
+                _write_index_file(path, header, tfidf)
+            except OSError as e:
+                print(f"[Raffle] Could not save TF-IDF weights for {taglist_file.filename}: {e}")
+
+        _tfidf[taglist_file.filepath] = (taglist_file.stamp, tfidf)
+        return tfidf
+
+
+def _kth_best(partial_scores, inverse_norms, k):
+    """The k-th best cosine similarity among taglists with partial scores (a lower bound of the final k-th best)"""
+    return heapq.nlargest(k, (score * inverse_norms[line_id] for line_id, score in partial_scores.items()))[-1]
+
+
+def _search_file(taglist_file, query_tags, line_ids, top_k, threshold=0.0):
+    """
+    The top_k (similarity, line id) pairs among line_ids for a set of query tags, best first.
+    Taglists that can't beat threshold (the k-th best similarity already found in other files) may be left out.
+
+    Scores are accumulated term at a time, starting with the tags that can add the most. Once the
+    k-th best score found so far is above what the remaining tags could add to a taglist not seen yet,
+    the remaining tags only update the taglists already found that can still reach the top k
+    (MaxScore pruning), so common tags like 1girl cost a few lookups instead of a pass over their posting lists.
+    """
+    tfidf = get_tfidf(taglist_file)
+    idf, inverse_norms, max_inverse_norms = tfidf["idf"], tfidf["inverse_norms"], tfidf["max_inverse_norms"]
+
+    query_tag_ids = [taglist_file.tag_ids.get(tag) for tag in query_tags]
+    query_tag_ids = [tag_id for tag_id in query_tag_ids if tag_id is not None]
+    if not query_tag_ids:
+        return []
+    query_norm = math.sqrt(sum(idf[tag_id] * idf[tag_id] for tag_id in query_tag_ids))
+
+    # (most a tag can add to any taglist's similarity, what it adds before dividing by the row norm, posting list)
+    terms = []
+    vocabulary = taglist_file.vocabulary
+    for tag_id in query_tag_ids:
+        weight = idf[tag_id] * idf[tag_id] / query_norm
+        terms.append((weight * max_inverse_norms[tag_id], weight, taglist_file.get_postings(vocabulary[tag_id])))
+    terms.sort(key=lambda term: term[0], reverse=True)
+    remaining_bound = sum(term[0] for term in terms)
+    remaining_weight = sum(term[1] for term in terms)
+
+    # Only taglists in the filtered pool are scored
+    pool = None if len(line_ids) == taglist_file.line_count else set(line_ids)
+    partial_scores = {}
+    candidates = None
+    for bound, weight, postings in terms:
+        if candidates is None and threshold <= remaining_bound and len(partial_scores) >= top_k \
+                and len(postings) > len(partial_scores):
+            threshold = max(threshold, _kth_best(partial_scores, inverse_norms, top_k))
+        if candidates is None and threshold > remaining_bound:
+            # No taglist that hasn't been scored yet can reach the top k any more,
+            # and neither can one whose score plus all the remaining tags stays below the threshold
+            candidates = {line_id for line_id, score in partial_scores.items()
+                          if (score + remaining_weight) * inverse_norms[line_id] >= threshold}
+        if candidates is not None:
+            if not candidates:
+                break
+            for line_id in _restrict(postings, candidates):
+                partial_scores[line_id] += weight
+        else:
+            get = partial_scores.get
+            if pool is None:
+                for line_id in postings:
+                    partial_scores[line_id] = get(line_id, 0.0) + weight
+            else:
+                for line_id in postings:
+                    if line_id in pool:
+                        partial_scores[line_id] = get(line_id, 0.0) + weight
+        remaining_bound -= bound
+        remaining_weight -= weight
+
+    # Ties go to the earlier line, i.e. the higher scoring post
+    scored = partial_scores if candidates is None else candidates
+    best = heapq.nlargest(top_k, ((partial_scores[line_id] * inverse_norms[line_id], -line_id) for line_id in scored))
+    return [(similarity, -negative_line_id) for similarity, negative_line_id in best]
+
+
+def find_similar_taglists(pools, query_tags, top_k):
+    """
+    The top_k taglists of the pools (a list of (taglist file, line ids), like Raffle's filtered pools) most similar
+    to a list of tags, by cosine similarity of their TF-IDF vectors. Each file is weighted by its own idf.
+    Returns a list of (similarity, taglist file, line id), most similar first.
+    """
+    query_tags = set(query_tags)
+    matches = []
+    threshold = 0.0
+    for file_position, (taglist_file, line_ids) in enumerate(pools):
+        if not len(line_ids):
+            continue
+        for similarity, line_id in _search_file(taglist_file, query_tags, line_ids, top_k, threshold):
+            matches.append((similarity, -file_position, -line_id, taglist_file))
+        if len(matches) >= top_k:
+            # Later files only need to find taglists that beat the current k-th best
+            matches = heapq.nlargest(top_k, matches, key=lambda match: match[:3])
+            threshold = matches[-1][0]
+    return [(similarity, taglist_file, -negative_line_id)
+            for similarity, _, negative_line_id, taglist_file in heapq.nlargest(top_k, matches, key=lambda m: m[:3])]
@@ -0,0 +1,48 @@
+import os
+import sys
+import types
+import random
+
+import pytest
+
+# The repository root is a ComfyUI custom node package with relative imports, and its __init__ starts
+# the index warm-up and needs ComfyUI's modules. Register the package without running the __init__:
+# as raffle_package for the tests, and under the folder's own name, which pytest imports it by.
+REPOSITORY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault("RAFFLE_WARMUP", "0")
+package = types.ModuleType("raffle_package")
+package.__path__ = [REPOSITORY_PATH]
+package.__file__ = os.path.join(REPOSITORY_PATH, "__init__.py")
+sys.modules.setdefault("raffle_package", package)
+sys.modules.setdefault(os.path.basename(REPOSITORY_PATH), package)
+
+
+@pytest.fixture
+def write_taglists(tmp_path):
+    """
+    Returns write(filename, line_count, seed), which writes a list file of 'post_id, score, tags' lines
+    whose tags follow a skewed frequency like the real lists, and returns its path.
+    """
+    def write(filename, line_count, seed, tag_count=60):
+        rng = random.Random(seed)
+        tags = [f"tag_{number}" for number in range(tag_count)]
+        weights = [1 / (rank + 1) for rank in range(tag_count)]
+        path = tmp_path / filename
+        with open(path, 'a', encoding='utf-8') as f:
+            for post_id in range(line_count):
+                line_tags = set(rng.choices(tags, weights, k=rng.randrange(1, 20)))
+                f.write(f"{post_id}, {rng.randrange(-5, 500)}, {', '.join(sorted(line_tags))}\n")
+        return str(path)
+    return write
+
+
+@pytest.fixture
+def index_cache(tmp_path, monkeypatch):
+    """Build indexes into a temporary folder instead of lists/index_cache"""
+    from raffle_package import taglist_index, taglist_similarity, category_counts
+
+    cache_path = str(tmp_path / "index_cache")
+    for module in (taglist_index, taglist_similarity, category_counts):
+        monkeypatch.setattr(module, "INDEX_CACHE_PATH", cache_path)
+    return cache_path
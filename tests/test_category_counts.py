@@ -0,0 +1,34 @@
+import random
+import operator
+from array import array
+
+import pytest
+
+from raffle_package.category_counts import _compare, LANE_HIGH_BIT
+from raffle_package.tag_columns import to_lanes
+
+OPERATORS = {">=": operator.ge, ">": operator.gt, "<=": operator.le, "<": operator.lt, "=": operator.eq, "!=": operator.ne}
+
+
+def lane_flags(lanes, line_count):
+    flags = array('H')
+    flags.frombytes(lanes.to_bytes(2 * line_count, 'little'))
+    return list(flags)
+
+
+@pytest.mark.parametrize("symbol", OPERATORS)
+def test_compare_matches_brute_force(symbol):
+    rng = random.Random(symbol)
+    counts = array('H', (rng.choice([0, 1, 2, 3, 5, 8, 40, LANE_HIGH_BIT - 1]) for _ in range(3000)))
+    ones = to_lanes(array('H', [1]) * len(counts))
+    for count in [0, 1, 2, 3, 4, 8, 39, 40, 41, LANE_HIGH_BIT - 1, LANE_HIGH_BIT, LANE_HIGH_BIT + 5]:
+        expected = [int(OPERATORS[symbol](value, count)) for value in counts]
+        assert lane_flags(_compare(to_lanes(counts), symbol, count, ones), len(counts)) == expected, count
+
+
+def test_lanes_do_not_carry_into_each_other():
+    # The largest count next to zeros: adding the offset to one lane must leave its neighbours alone
+    counts = array('H', [LANE_HIGH_BIT - 1, 0, LANE_HIGH_BIT - 1, 0])
+    ones = to_lanes(array('H', [1]) * len(counts))
+    assert lane_flags(_compare(to_lanes(counts), ">=", 1, ones), len(counts)) == [1, 0, 1, 0]
+    assert lane_flags(_compare(to_lanes(counts), "<", 1, ones), len(counts)) == [0, 1, 0, 1]
@@ -0,0 +1,20 @@
+import pytest
+
+from raffle_package.raffle import keyed_permutation
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 4, 5, 16, 17, 100, 255, 256, 1000, 4099])
+def test_is_a_bijection(size):
+    positions = [keyed_permutation(index, size, key=42) for index in range(size)]
+    assert sorted(positions) == list(range(size))
+
+
+def test_same_key_gives_the_same_permutation():
+    assert [keyed_permutation(index, 500, key=7) for index in range(500)] == \
+        [keyed_permutation(index, 500, key=7) for index in range(500)]
+
+
+def test_keys_give_different_permutations():
+    permutations = {tuple(keyed_permutation(index, 500, key=key) for index in range(500)) for key in range(8)}
+    assert len(permutations) == 8
+    assert tuple(range(500)) not in permutations
@@ -0,0 +1,78 @@
+import random
+from fnmatch import fnmatchcase
+
+import pytest
+
+from raffle_package import tag_query, taglist_index
+from raffle_package.tag_query import parse_tag_query, query_taglists, TagTerm, WildcardTerm, NotQuery, OrQuery, AndQuery
+from raffle_package.taglist_index import TaglistFile, split_taglist
+
+
+def matches(node, tags):
+    """Plain evaluation of a parsed query on the tags of one taglist"""
+    if isinstance(node, TagTerm):
+        return node.tag in tags
+    if isinstance(node, WildcardTerm):
+        return any(fnmatchcase(tag, node.pattern) for tag in tags)
+    if isinstance(node, NotQuery):
+        return not matches(node.child, tags)
+    if isinstance(node, OrQuery):
+        return any(matches(child, tags) for child in node.children)
+    assert isinstance(node, AndQuery)
+    return all(matches(child, tags) for child in node.children)
+
+
+def random_query(rng, depth=0):
+    if depth >= 3 or rng.random() < 0.35:
+        return rng.choice([f"tag_{rng.randrange(40)}", f"tag_{rng.randrange(1, 6)}*", f"*_{rng.randrange(10)}", "*"])
+    kind = rng.choice(["AND", "OR", "NOT", "()"])
+    if kind == "NOT":
+        return "NOT " + random_query(rng, depth + 1)
+    if kind == "()":
+        return "(" + random_query(rng, depth + 1) + ")"
+    return f"({random_query(rng, depth + 1)} {kind} {random_query(rng, depth + 1)})"
+
+
+@pytest.fixture
+def taglist_file(index_cache, write_taglists):
+    return TaglistFile("taglists-test.txt", write_taglists("taglists-test.txt", 800, seed=5))
+
+
+# 0 evaluates every query as sets of line ids, a large ratio every query with candidates on columns
+@pytest.mark.parametrize("lanes_ratio", [0, tag_query.LANES_RATIO, 10 ** 9])
+def test_query_matches_brute_force(taglist_file, monkeypatch, lanes_ratio):
+    monkeypatch.setattr(tag_query, "LANES_RATIO", lanes_ratio)
+    rng = random.Random(lanes_ratio)
+    line_tags = [set(split_taglist(taglist_file.get_line(line_id))[1]) for line_id in range(taglist_file.line_count)]
+    for _ in range(150):
+        text = random_query(rng)
+        query = parse_tag_query(text)
+        must_include = {f"tag_{rng.randrange(8)}" for _ in range(rng.randrange(3))}
+        exclude = {f"tag_{rng.randrange(60)}" for _ in range(rng.randrange(6))}
+        expected = [
+            line_id for line_id, tags in enumerate(line_tags)
+            if matches(query, tags) and must_include <= tags and not exclude & tags
+        ]
+        assert list(query_taglists(taglist_file, query, must_include, exclude)) == expected, text
+
+
+def test_pattern_cache_is_bounded(taglist_file):
+    for number in range(3 * taglist_index.PATTERN_CACHE_MAX_ENTRIES):
+        taglist_file.get_pattern_postings(f"*{number}")
+    assert len(taglist_file._pattern_postings._entries) == taglist_index.PATTERN_CACHE_MAX_ENTRIES
+
+
+def test_pattern_postings_cover_delta_and_non_ascii_tags(index_cache, write_taglists, tmp_path):
+    filepath = write_taglists("taglists-test.txt", 200, seed=7)
+    with open(filepath, 'a', encoding='utf-8') as f:
+        f.write("200, 3, tag_1, café_au_lait, ☆_tag\n")
+    TaglistFile("taglists-test.txt", filepath)
+    # Appended lines go into a delta segment, with tags the mapped vocabulary doesn't have
+    with open(filepath, 'a', encoding='utf-8') as f:
+        f.write("201, 5, tag_2, new_tag_1, caféine\n202, 1, ☆_tag, tag_59\n")
+    taglist_file = TaglistFile("taglists-test.txt", filepath)
+    assert taglist_file.delta is not None
+    line_tags = [set(split_taglist(taglist_file.get_line(line_id))[1]) for line_id in range(taglist_file.line_count)]
+    for pattern in ["*", "*_1", "tag_5*", "caf*", "*é*", "☆*", "*tag*1", "no_*_match"]:
+        expected = [line_id for line_id, tags in enumerate(line_tags) if any(fnmatchcase(tag, pattern) for tag in tags)]
+        assert list(taglist_file.get_pattern_postings(pattern)) == expected, pattern
@@ -0,0 +1,71 @@
+import random
+
+import pytest
+
+from raffle_package.tag_tokenizer import tokenize_tags, normalize_tags_cached
+
+# Pieces the fuzzed strings are made of: tag characters, separators and every kind of whitespace
+ALPHABET = ["a", "b", "_", "\u00e9", "\u732b", " ", "  ", ",", ", ", ",,", "\n", "\r", "\r\n", "\t", "\xa0", "\u2003", "\u3000"]
+
+
+def old_raffle_normalize_tags(tag_string):
+    """Raffle.normalize_tags before the shared tokenizer"""
+    tag_string = tag_string.replace('\r\n', '\n')
+    tag_string = tag_string.replace('\n', ',')
+    while '  ' in tag_string:
+        tag_string = tag_string.replace('  ', ' ')
+    while ',,' in tag_string:
+        tag_string = tag_string.replace(',,', ',')
+    tags = tag_string.replace(', ', ',').split(',')
+    return [tag.strip().replace(' ', '_') for tag in tags if tag.strip()]
+
+
+def old_strength_normalize_tags(tag_string):
+    """TagCategoryStrength._normalize_tags before the shared tokenizer"""
+    tag_string = tag_string.replace('\r\n', '\n')
+    tag_string = tag_string.replace('\n', ',')
+    while '  ' in tag_string:
+        tag_string = tag_string.replace('  ', ' ')
+    while ',,' in tag_string:
+        tag_string = tag_string.replace(',,', ',')
+    tags = tag_string.replace(', ', ',').split(',')
+    return [tag.strip() for tag in tags if tag.strip()]
+
+
+def fuzzed_strings(count, seed):
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield "".join(rng.choice(ALPHABET) for _ in range(rng.randrange(0, 24)))
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_matches_old_raffle_normalization(seed):
+    for tag_string in fuzzed_strings(5000, seed):
+        assert tokenize_tags(tag_string) == old_raffle_normalize_tags(tag_string), repr(tag_string)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_matches_old_strength_normalization(seed):
+    for tag_string in fuzzed_strings(5000, seed):
+        assert tokenize_tags(tag_string, underscores=False) == old_strength_normalize_tags(tag_string), repr(tag_string)
+
+
+@pytest.mark.parametrize("tag_string, expected", [
+    ("red hair, blue hair", ["red_hair", "blue_hair"]),
+    ("red_hair,blue hair", ["red_hair", "blue_hair"]),
+    ("red hair\nblue_hair", ["red_hair", "blue_hair"]),
+    ("red hair,\r\nblue_hair", ["red_hair", "blue_hair"]),
+    ("red hair,,blue_hair", ["red_hair", "blue_hair"]),
+    ("red   hair,blue  hair", ["red_hair", "blue_hair"]),
+    ("", []),
+    (" , \n ,", []),
+])
+def test_examples(tag_string, expected):
+    assert tokenize_tags(tag_string) == expected
+
+
+def test_cached_result_is_an_immutable_copy():
+    tags = normalize_tags_cached("red hair, blue hair")
+    assert tags == ("red_hair", "blue_hair")
+    assert normalize_tags_cached("red hair, blue hair") is tags
+    assert normalize_tags_cached("red hair, blue hair", underscores=False) == ("red hair", "blue hair")
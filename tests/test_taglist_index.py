@@ -0,0 +1,91 @@
+import os
+import shutil
+from array import array
+
+import pytest
+
+from raffle_package import taglist_index
+from raffle_package.taglist_index import TaglistFile, _index_generations, _delta_path, _write_index_file
+
+
+def index_contents(taglist_file):
+    """Everything a loaded index answers, to compare two indexes of the same lines"""
+    postings = {tag: list(taglist_file.get_postings(tag)) for tag in taglist_file.vocabulary}
+    lines = [taglist_file.get_line(line_id) for line_id in range(taglist_file.line_count)]
+    return postings, lines, list(taglist_file.scores)
+
+
+def test_appended_lines_are_indexed_as_a_delta_and_merged(index_cache, write_taglists, tmp_path):
+    filepath = write_taglists("taglists-test.txt", 300, seed=1)
+    assert TaglistFile("taglists-test.txt", filepath).delta is None
+
+    write_taglists("taglists-test.txt", 120, seed=2)
+    appended = TaglistFile("taglists-test.txt", filepath)
+    assert appended.delta_line_count == 120
+    assert appended.line_count == 420
+
+    # The same lines indexed in one go
+    shutil.copy(filepath, tmp_path / "taglists-copy.txt")
+    expected = index_contents(TaglistFile("taglists-copy.txt", str(tmp_path / "taglists-copy.txt")))
+    assert index_contents(appended) == expected
+
+    appended.merge_delta()
+    # The merge is written as a new generation next to the mapped one, which is then removed
+    assert _index_generations(filepath) == [1]
+    assert not os.path.exists(_delta_path(filepath))
+    assert index_contents(appended) == expected
+
+    merged = TaglistFile("taglists-test.txt", filepath)
+    assert merged.delta is None
+    assert index_contents(merged) == expected
+
+
+def test_rebuilt_index_is_written_as_a_new_generation(index_cache, write_taglists):
+    filepath = write_taglists("taglists-test.txt", 50, seed=3)
+    TaglistFile("taglists-test.txt", filepath)
+    # Rewriting the file (not only appending to it) needs a full rebuild
+    os.remove(filepath)
+    write_taglists("taglists-test.txt", 80, seed=4)
+    rebuilt = TaglistFile("taglists-test.txt", filepath)
+    assert rebuilt.line_count == 80
+    assert _index_generations(filepath) == [1]
+    assert taglist_index._index_is_current(filepath)
+
+
+class UnwritableArray:
+    typecode = 'I'
+    itemsize = 4
+
+    def __len__(self):
+        return 1
+
+    def tobytes(self):
+        raise OSError("disk full")
+
+
+def test_failed_write_leaves_no_temp_file(tmp_path):
+    path = str(tmp_path / "cache" / "broken.index")
+    with pytest.raises(OSError):
+        _write_index_file(path, {}, {"values": array('I', [1, 2]), "broken": UnwritableArray()})
+    assert os.listdir(tmp_path / "cache") == []
+
+
+def test_compressed_copy_is_only_used_while_it_is_up_to_date(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(taglist_index, "LISTS_PATH", str(tmp_path))
+    text_path = tmp_path / "taglists-test.txt"
+    text_path.write_text("1girl, solo\n")
+    compressed_path = tmp_path / "taglists-test.txt.gz"
+    compressed_path.write_bytes(b"")
+
+    os.utime(text_path, ns=(1_000_000_000, 1_000_000_000))
+    os.utime(compressed_path, ns=(2_000_000_000, 2_000_000_000))
+    assert taglist_index.resolve_taglist_path("taglists-test.txt") == str(compressed_path)
+
+    # The text file was changed after it was compressed
+    os.utime(text_path, ns=(3_000_000_000, 3_000_000_000))
+    assert taglist_index.resolve_taglist_path("taglists-test.txt") == str(text_path)
+    assert taglist_index.resolve_taglist_path("taglists-test.txt") == str(text_path)
+    assert capsys.readouterr().out.count("is older than") == 1
+
+    os.remove(text_path)
+    assert taglist_index.resolve_taglist_path("taglists-test.txt") == str(compressed_path)
@@ -0,0 +1,48 @@
+import math
+import random
+from array import array
+
+import pytest
+
+from raffle_package.taglist_index import TaglistFile, split_taglist
+from raffle_package.taglist_similarity import find_similar_taglists, get_tfidf
+
+
+def brute_force_similarities(taglist_file, line_ids, query_tags):
+    """Cosine similarity of every taglist of line_ids with the query, from the full TF-IDF vectors"""
+    idf = get_tfidf(taglist_file)["idf"]
+    weights = {tag: idf[taglist_file.tag_ids[tag]] for tag in taglist_file.vocabulary}
+    query = {tag: weights[tag] for tag in query_tags if tag in weights}
+    query_norm = math.sqrt(sum(weight * weight for weight in query.values()))
+    similarities = {}
+    for line_id in line_ids:
+        tags = set(split_taglist(taglist_file.get_line(line_id))[1])
+        row_norm = math.sqrt(sum(weights[tag] ** 2 for tag in tags))
+        similarities[line_id] = sum(weight * weight for tag, weight in query.items() if tag in tags) / (query_norm * row_norm)
+    return similarities
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_maxscore_search_matches_brute_force(index_cache, write_taglists, seed):
+    rng = random.Random(seed)
+    pools = []
+    for number in range(2):
+        filename = f"taglists-{number}.txt"
+        taglist_file = TaglistFile(filename, write_taglists(filename, 600, seed * 10 + number))
+        line_ids = range(taglist_file.line_count) if number == 0 else sorted(rng.sample(range(taglist_file.line_count), 250))
+        pools.append((taglist_file, array('I', line_ids)))
+
+    for top_k in (1, 5, 40):
+        query_tags = rng.sample(sorted(pools[0][0].vocabulary), rng.randrange(1, 8))
+        # Taglists sharing no tag with the query are never matches
+        expected = sorted(
+            (similarity for taglist_file, line_ids in pools
+             for similarity in brute_force_similarities(taglist_file, line_ids, query_tags).values() if similarity),
+            reverse=True,
+        )[:top_k]
+        matches = find_similar_taglists(pools, query_tags, top_k)
+        assert [similarity for similarity, _, _ in matches] == pytest.approx(expected)
+        pool_line_ids = {pool_file.filename: line_ids for pool_file, line_ids in pools}
+        for similarity, taglist_file, line_id in matches:
+            assert line_id in pool_line_ids[taglist_file.filename]
+            assert similarity == pytest.approx(brute_force_similarities(taglist_file, [line_id], query_tags)[line_id])
@@ -0,0 +1,80 @@
+import math
+import random
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+
+# How a taglist's danbooru score turns into its sampling weight
+SCORE_WEIGHTINGS = ["uniform", "linear", "log", "temperature"]
+
+
+def score_weight(score, score_weighting, temperature=1.0):
+    """
+    Sampling weight for one score. Negative scores count as 0, and every taglist keeps a non-zero weight.
+    - linear:      score + 1
+    - log:         log(score + 1) + 1, flattens the gap between popular and average posts
+    - temperature: (score + 1) ** (1 / temperature), 1.0 is linear, higher flattens towards uniform, lower sharpens
+    """
+    score = max(score, 0)
+    if score_weighting == "linear":
+        return score + 1.0
+    if score_weighting == "log":
+        return math.log1p(score) + 1.0
+    if score_weighting == "temperature":
+        return (score + 1.0) ** (1.0 / temperature)
+    return 1.0
+
+
+def build_alias_table(weights):
+    """
+    Build a Walker/Vose alias table for the given weights in O(n).
+    Returns (probabilities, aliases) arrays; see alias_draw.
+    """
+    count = len(weights)
+    total = math.fsum(weights)
+    probabilities = array('d', (weight * count / total for weight in weights))
+    aliases = array('I', bytes(4 * count))
+
+    small = [i for i, probability in enumerate(probabilities) if probability < 1.0]
+    large = [i for i, probability in enumerate(probabilities) if probability >= 1.0]
+    while small and large:
+        small_index = small.pop()
+        large_index = large[-1]
+        aliases[small_index] = large_index
+        probabilities[large_index] += probabilities[small_index] - 1.0
+        if probabilities[large_index] < 1.0:
+            small.append(large.pop())
+
+    # Whatever is left over (rounding errors) is a full column
+    for index in small + large:
+        probabilities[index] = 1.0
+    return probabilities, aliases
+
+
+def alias_draw(alias_table, seed):
+    """Pick an index from an alias table in O(1), deterministically for a seed"""
+    probabilities, aliases = alias_table
+    rng = random.Random(seed)
+    index = rng.randrange(len(probabilities))
+    return index if rng.random() < probabilities[index] else aliases[index]
+
+
+def alias_table_size(alias_table):
+    """Bytes held by an alias table, for the cache bound"""
+    probabilities, aliases = alias_table
+    return len(probabilities) * probabilities.itemsize + len(aliases) * aliases.itemsize
+
+
+def build_prefix_sums(weights):
+    """Running totals of the weights, for prefix_sum_draw"""
+    return array('d', accumulate(weights))
+
+
+def prefix_sum_draw(prefix_sums, seed, key="prefix"):
+    """
+    Pick an index in proportion to the weights behind prefix_sums in O(log n), deterministically for a seed.
+    Indexes with a weight of 0 are never picked. The key gives the draw its own random stream,
+    so it doesn't follow whatever else is drawn from the same seed.
+    """
+    target = random.Random(f"raffle:{key}:{seed}").random() * prefix_sums[-1]
+    return min(bisect_right(prefix_sums, target), len(prefix_sums) - 1)